@@ -19,38 +19,349 @@
 #!/usr/bin/env python3
 """This script contains all of the modules that are tied to the camera"""
 
-import picamera
-from picamera.array import PiRGBArray
+import os
+import queue
+import threading
 import time
 import numpy as np
 import cv2
 from raspberry_pi_libraries import multi_wrapper
 
+try:
+    import picamera
+except ImportError:
+    # Only PiCameraSource needs picamera, every other source works off the Pi
+    picamera = None
+
+def _write_chunk(flat, offset, data):
+    """Copies data into flat at offset, dropping whatever does not fit, and returns the offset
+    after data"""
+    size = len(data)
+    end = min(offset + size, len(flat))
+    if end > offset:
+        flat[offset:end] = np.frombuffer(data, dtype=np.uint8, count=end - offset)
+    return offset + size
+
 class Packages:
     """Encapsulates all classes in this file in case inheritance of these classes is necessary"""
 
-    class Frame:
-        """Keeps track of all data regarding the video stream"""
-        def __init__(self, name, img_format="bgr"):
+    class FrameSource:
+        """Base class of everything Frame can capture from
+
+        Sources write every frame into a buffer they are given, which is either the frame
+        buffer of Frame or a slot of its continuous capture ring"""
+        def capture(self, frame):
+            """Writes the next frame into frame, raises Break when there are no more frames"""
+            raise NotImplementedError
+
+        def capture_continuous(self, ring):
+            """Fills ring with frames forever, yielding after every frame"""
+            while True:
+                self.capture(ring.get_slot())
+                ring.flush()
+                yield ring
+
+        def close(self):
+            """Releases whatever the source holds on to"""
+
+        def get_size(self):
+            """Returns (width, height) of the frames"""
+            return self._width, self._height
+
+        def get_channels(self):
+            """Returns the channels of the frames, frames with one channel are 2D"""
+            return 3
+
+        def get_padded_size(self):
+            """Returns (width, height) of the buffers the source streams frames into"""
+            return self.get_size()
+
+        def get_camera(self):
+            """Returns the underlying video stream object, if any"""
+            return None
+
+    class PiCameraSource(FrameSource):
+        """Captures from the Raspberry Pi camera through its video port
+
+        width and height set the sensor resolution. roi is an optional normalized
+        (x, y, width, height) region the sensor crops to and resize an optional (width, height)
+        the GPU scales frames to, so discarded pixels are never copied. img_format "gray"
+        captures YUV and keeps only the Y plane"""
+        def __init__(self, width=640, height=480, framerate=32, img_format="bgr", resize=None,
+                     roi=None):
+            if picamera is None:
+                raise ImportError("PiCameraSource requires the picamera package")
             self._format = img_format
-            self._width = 640
-            self._height = 480
+            self._camera_format = "yuv" if img_format == "gray" else img_format
+            self._resize = tuple(resize) if resize else None
+            self._width, self._height = self._resize or (width, height)
             self._camera = picamera.PiCamera()
-            self._camera.resolution = (self._width, self._height)
-            self._camera.framerate = 32
+            self._camera.resolution = (width, height)
+            self._camera.framerate = framerate
+            if roi is not None:
+                self._camera.zoom = tuple(roi)
             self._camera.start_preview()
             time.sleep(0.1)
             self._camera.stop_preview()
+
+            # Padded frames and YUV planes cannot be captured straight into the frame buffer
+            padded_width, padded_height = self.get_padded_size()
+            self._padded = None
+            if (self._format == "gray"
+                    or (padded_width, padded_height) != (self._width, self._height)):
+                shape = (padded_height, padded_width)
+                if self._format != "gray":
+                    shape += (self.get_channels(),)
+                self._padded = np.empty(shape, dtype=np.uint8)
+                self._padded_flat = self._padded.reshape(-1)
+            self._offset = 0
+
+        def capture(self, frame):
+            """Captures the next frame into frame, through a padded buffer if needed"""
+            if self._padded is None:
+                self._camera.capture(frame, format=self._camera_format, use_video_port=True,
+                                     resize=self._resize)
+                return
+            self._offset = 0
+            self._camera.capture(self, format=self._camera_format, use_video_port=True,
+                                 resize=self._resize)
+            np.copyto(frame, self._padded[:self._height, :self._width])
+
+        def capture_continuous(self, ring):
+            """Streams frames into ring with picamera writing to it as a custom output"""
+            return self._camera.capture_continuous(ring, format=self._camera_format,
+                                                   use_video_port=True, resize=self._resize)
+
+        def write(self, data):
+            """Receives frame bytes from picamera when capturing through the padded buffer"""
+            self._offset = _write_chunk(self._padded_flat, self._offset, data)
+            return len(data)
+
+        def get_channels(self):
+            """Returns 1 for gray frames and 3 otherwise"""
+            return 1 if self._format == "gray" else 3
+
+        def get_padded_size(self):
+            """Returns the frame size padded to a multiple of 32 pixels wide and 16 high"""
+            return (self._width + 31) // 32 * 32, (self._height + 15) // 16 * 16
+
+        def close(self):
+            """Closes the camera"""
+            self._camera.close()
+
+        def get_camera(self):
+            """Returns the PiCamera"""
+            return self._camera
+
+    class VideoSource(FrameSource):
+        """Captures from a cv2.VideoCapture, which can be a video file or a device index
+
+        Frames are resized when width and height differ from the size of the video"""
+        def __init__(self, path, width=None, height=None, loop=False):
+            self._capture = cv2.VideoCapture(path)
+            if not self._capture.isOpened():
+                raise FileNotFoundError(f"Could not open video source {path!r}")
+            self._loop = loop
+            native = (int(self._capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                      int(self._capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+            self._width = width or native[0]
+            self._height = height or native[1]
+            self._decoded = None
+            if (self._width, self._height) != native:
+                self._decoded = np.empty((native[1], native[0], 3), dtype=np.uint8)
+
+        def capture(self, frame):
+            """Decodes the next frame into frame, rewinding at the end if loop is set"""
+            target = frame if self._decoded is None else self._decoded
+            grabbed, _ = self._capture.read(target)
+            if not grabbed and self._loop:
+                self._capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                grabbed, _ = self._capture.read(target)
+            if not grabbed:
+                raise multi_wrapper.Packages.Break()
+            if self._decoded is not None:
+                cv2.resize(self._decoded, (self._width, self._height), dst=frame)
+
+        def close(self):
+            """Releases the video capture"""
+            self._capture.release()
+
+        def get_camera(self):
+            """Returns the cv2.VideoCapture"""
+            return self._capture
+
+    class DirectorySource(FrameSource):
+        """Captures the images of a directory in the order of Dataset.get_ordered_path
+
+        Frames are resized when width and height differ from the size of the first image. With
+        preload set every image is decoded once up front so that decoding is not measured"""
+        def __init__(self, target_dir, width=None, height=None, loop=False, preload=False):
+            self._paths = [os.path.join(target_dir, name)
+                           for name in multi_wrapper.Packages.Dataset.get_ordered_path(target_dir)]
+            if not self._paths:
+                raise FileNotFoundError(f"No images in {target_dir!r}")
+            self._loop = loop
+            self._index = 0
+            first = self._read(self._paths[0])
+            self._width = width or first.shape[1]
+            self._height = height or first.shape[0]
+            self._images = None
+            if preload:
+                self._images = [self._read(path) for path in self._paths]
+
+        def capture(self, frame):
+            """Writes the next image into frame"""
+            if self._index == len(self._paths):
+                if not self._loop:
+                    raise multi_wrapper.Packages.Break()
+                self._index = 0
+            if self._images is not None:
+                image = self._images[self._index]
+            else:
+                image = self._read(self._paths[self._index])
+            self._index += 1
+            if image.shape[:2] == frame.shape[:2]:
+                np.copyto(frame, image)
+            else:
+                cv2.resize(image, (self._width, self._height), dst=frame)
+
+        @staticmethod
+        def _read(path):
+            """Decodes an image, failing loudly if it cannot be read"""
+            image = cv2.imread(path)
+            if image is None:
+                raise FileNotFoundError(f"Could not decode {path}")
+            return image
+
+    class SyntheticSource(FrameSource):
+        """Generates reproducible frames of a colored square moving over a noisy background
+
+        With framerate set, capture sleeps so frames arrive at that rate like from a camera"""
+        def __init__(self, width=640, height=480, framerate=None, seed=0, square_size=80,
+                     color=(0, 0, 255)):
+            self._width = width
+            self._height = height
+            self._period = 1.0 / framerate if framerate else None
+            self._square_size = min(square_size, width, height)
+            self._color = np.array(color, dtype=np.uint8)
+            rng = np.random.default_rng(seed)
+            self._background = rng.integers(0, 64, (height, width, 3), dtype=np.uint8)
+            self._index = 0
+            self._next_time = None
+
+        def capture(self, frame):
+            """Draws the next frame into frame"""
+            if self._period is not None:
+                now = time.perf_counter()
+                if self._next_time is not None and now < self._next_time:
+                    time.sleep(self._next_time - now)
+                self._next_time = max(now, self._next_time or now) + self._period
+            np.copyto(frame, self._background)
+            x, y = self.get_square_position(self._index)
+            frame[y:y + self._square_size, x:x + self._square_size] = self._color
+            self._index += 1
+
+        def get_square_position(self, index):
+            """Returns the top left corner of the square in frame number index"""
+            x_range = self._width - self._square_size + 1
+            y_range = self._height - self._square_size + 1
+            return (index * 7) % x_range, (index * 3) % y_range
+
+    class Frame:
+        """Keeps track of all data regarding the video stream
+
+        Frames come from source, which defaults to a PiCameraSource built from the remaining
+        arguments. Gray frames are 2D arrays"""
+        def __init__(self, name, img_format="bgr", source=None, width=640, height=480,
+                     framerate=32, resize=None, roi=None):
+            self._format = img_format
+            if source is None:
+                source = Packages.PiCameraSource(width, height, framerate, img_format, resize,
+                                                 roi)
+            self._source = source
+            self._width, self._height = self._source.get_size()
+            self._camera = self._source.get_camera()
             self._name = name
-            self._frame = np.empty((self._height, self._width, 3), dtype=np.uint8)
+            self._frame = np.empty(self._get_shape(self._width, self._height), dtype=np.uint8)
+            self._ring = None
+            self._capture_thread = None
 
         def capture_frame(self):
-            """Reads the frame from the video stream"""
+            """Reads the frame from the video stream
+
+            While continuous capture runs this waits for the next frame of the ring instead"""
             try:
-                self._camera.capture(self._frame, format=self._format, use_video_port=True)
+                if self._ring is not None:
+                    self.get_next_frame()
+                    return
+                self._source.capture(self._frame)
             except:
                 raise multi_wrapper.Packages.Break()
 
+        def start_capture(self, slot_num=3):
+            """Starts capturing continuously from the source into a ring of frame buffers
+
+            At least 3 slots are needed so one can be written while the latest frame is ready
+            and the previous one is still in use by the caller"""
+            if self._ring is not None:
+                raise RuntimeError("Continuous capture is already running")
+            padded_width, padded_height = self._source.get_padded_size()
+            self._ring = self._FrameRing(max(slot_num, 3),
+                                         self._get_shape(self._width, self._height),
+                                         self._get_shape(padded_width, padded_height))
+            self._capture_thread = threading.Thread(target=self._capture_loop, daemon=True)
+            self._capture_thread.start()
+
+        def stop_capture(self):
+            """Stops continuous capture and keeps the latest frame in the frame buffer"""
+            if self._ring is None:
+                return
+            self._ring.close()
+            self._capture_thread.join()
+            self._frame = self._frame.copy()
+            self._ring = None
+            self._capture_thread = None
+
+        def get_latest_frame(self):
+            """Returns (sequence number, frame) of the newest captured frame without copying
+
+            The frame stays valid until the next call to get_latest_frame or get_next_frame"""
+            sequence, frame = self._get_ring().take(wait=False)
+            self._frame = frame
+            return sequence, frame
+
+        def get_next_frame(self, timeout=None):
+            """Waits for a frame newer than the last one returned and returns it like
+            get_latest_frame"""
+            sequence, frame = self._get_ring().take(wait=True, timeout=timeout)
+            self._frame = frame
+            return sequence, frame
+
+        def get_dropped_frames(self):
+            """Returns how many captured frames were overwritten before they were taken"""
+            return self._ring.get_dropped() if self._ring is not None else 0
+
+        def _get_shape(self, width, height):
+            """Returns the array shape of a frame of the source at the given size"""
+            channels = self._source.get_channels()
+            return (height, width) if channels == 1 else (height, width, channels)
+
+        def _get_ring(self):
+            """Returns the ring of the running continuous capture"""
+            if self._ring is None:
+                raise RuntimeError("Continuous capture is not running")
+            return self._ring
+
+        def _capture_loop(self):
+            """Feeds the ring from the source until continuous capture is stopped"""
+            ring = self._ring
+            try:
+                for _ in self._source.capture_continuous(ring):
+                    if ring.is_closed():
+                        break
+            except Exception as e:
+                ring.fail(e)
+
         def preprocessing(self):
             """Preprocesses the frame"""
 
@@ -65,10 +376,19 @@ class Packages:
             """Returns name of the camera"""
             return self._name
 
+        def close(self):
+            """Stops continuous capture and closes the source"""
+            self.stop_capture()
+            self._source.close()
+
         def get_camera(self):
             """Returns video stream object"""
             return self._camera
 
+        def get_source(self):
+            """Returns the source frames are captured from"""
+            return self._source
+
         def get_width(self):
             """Returns raw width of frame"""
             return self._width
@@ -80,3 +400,196 @@ class Packages:
         def get_frame(self):
             """Returns raw frame"""
             return self._frame
+
+        class _FrameRing:
+            """Preallocated frame buffers filled by a frame source
+
+            Sources either write into get_slot() directly or, like picamera's custom outputs,
+            call write with the bytes of a frame. flush publishes the frame once it is complete.
+            The slot being written is never the latest frame nor the frame held by the reader"""
+            def __init__(self, slot_num, shape, padded_shape):
+                self._slots = np.empty((slot_num,) + padded_shape, dtype=np.uint8)
+                self._flat = self._slots.reshape(slot_num, -1)
+                self._views = [slot[:shape[0], :shape[1]] for slot in self._slots]
+                self._condition = threading.Condition()
+                self._writing = 0
+                self._offset = 0
+                self._latest = None
+                self._held = None
+                self._sequence = 0
+                self._taken = 0
+                self._dropped = 0
+                self._closed = False
+                self._error = None
+
+            def write(self, data):
+                """Copies the next bytes of the frame into the slot being written"""
+                self._offset = _write_chunk(self._flat[self._writing], self._offset, data)
+                return len(data)
+
+            def get_slot(self):
+                """Returns the frame sized view of the slot being written"""
+                return self._views[self._writing]
+
+            def flush(self):
+                """Publishes the slot being written as the latest frame"""
+                self._offset = 0
+                with self._condition:
+                    self._latest = self._writing
+                    self._sequence += 1
+                    self._writing = next(slot for slot in range(len(self._slots))
+                                         if slot not in (self._latest, self._held))
+                    self._condition.notify_all()
+
+            def take(self, wait, timeout=None):
+                """Holds and returns (sequence number, frame) of the latest frame
+
+                Waits for the first frame, or with wait set for a frame newer than the last one
+                taken"""
+                oldest = self._taken if wait else 0
+                with self._condition:
+                    if not self._condition.wait_for(
+                            lambda: self._error or self._closed or self._sequence > oldest,
+                            timeout):
+                        raise TimeoutError("No new frame was captured in time")
+                    if self._error is not None:
+                        raise self._error
+                    if self._sequence <= oldest:
+                        raise RuntimeError("Continuous capture was stopped")
+                    self._dropped += max(self._sequence - self._taken - 1, 0)
+                    self._taken = self._sequence
+                    self._held = self._latest
+                    return self._sequence, self._views[self._latest]
+
+            def fail(self, error):
+                """Hands an error of the capture thread to the reader"""
+                with self._condition:
+                    self._error = error
+                    self._condition.notify_all()
+
+            def close(self):
+                """Makes the capture thread stop after the current frame"""
+                with self._condition:
+                    self._closed = True
+                    self._condition.notify_all()
+
+            def is_closed(self):
+                """Returns whether close was called"""
+                return self._closed
+
+            def get_dropped(self):
+                """Returns how many frames were overwritten before they were taken"""
+                return self._dropped
+
+    class FrameRecorder:
+        """Records raw frames of a Frame into preallocated memory mapped files
+
+        path + ".frames.npy" holds max_frames fixed size frame records and path + ".index.npy"
+        the timestamp and sequence number of every record. record only copies the frame into
+        one of queue_size staging buffers, a writer thread copies it into the mapped file, so
+        the capture loop never waits on disk or image encoding. export turns a recording into
+        numbered images that ReadDir and Dataset.get_ordered_path can read"""
+        INDEX_DTYPE = np.dtype([('timestamp', np.float64), ('sequence', np.int64)])
+
+        def __init__(self, frame, path, max_frames, queue_size=8):
+            self._frame = frame
+            self._path = path
+            shape = frame.get_frame().shape
+            self._frames = np.lib.format.open_memmap(path + ".frames.npy", mode="w+",
+                                                     dtype=np.uint8, shape=(max_frames,) + shape)
+            self._index = np.lib.format.open_memmap(path + ".index.npy", mode="w+",
+                                                    dtype=self.INDEX_DTYPE, shape=(max_frames,))
+            self._index['sequence'] = -1
+            self._preallocate(path + ".frames.npy")
+
+            self._free = queue.Queue()
+            for _ in range(queue_size):
+                self._free.put(np.empty(shape, dtype=np.uint8))
+            self._pending = queue.Queue()
+            self._count = 0
+            self._dropped = 0
+            self._writer = threading.Thread(target=self._write_loop, daemon=True)
+            self._writer.start()
+
+        def record(self, image=None, timestamp=None, sequence=None):
+            """Queues the current frame, or image, for writing and returns whether it was queued
+
+            Frames are dropped and counted when every staging buffer is in use or the file is
+            full"""
+            if image is None:
+                image = self._frame.get_frame()
+            if self._count == len(self._frames):
+                self._dropped += 1
+                return False
+            try:
+                buffer = self._free.get_nowait()
+            except queue.Empty:
+                self._dropped += 1
+                return False
+            np.copyto(buffer, image)
+            if timestamp is None:
+                timestamp = time.time()
+            if sequence is None:
+                sequence = self._count
+            self._pending.put((self._count, timestamp, sequence, buffer))
+            self._count += 1
+            return True
+
+        def close(self):
+            """Waits for queued frames to be written and flushes the files"""
+            if self._writer is None:
+                return
+            self._pending.put(None)
+            self._writer.join()
+            self._writer = None
+            self._frames.flush()
+            self._index.flush()
+
+        def get_count(self):
+            """Returns how many frames were queued for writing"""
+            return self._count
+
+        def get_dropped_frames(self):
+            """Returns how many frames were dropped"""
+            return self._dropped
+
+        @staticmethod
+        def load(path):
+            """Returns the frames and index entries of a recording as read only memory maps"""
+            frames = np.load(path + ".frames.npy", mmap_mode="r")
+            index = np.load(path + ".index.npy", mmap_mode="r")
+            count = int(np.count_nonzero(index['sequence'] >= 0))
+            return frames[:count], index[:count]
+
+        @staticmethod
+        def export(path, target_dir, text="img", ext=".png"):
+            """Writes every frame of a recording to target_dir as text0.ext, text1.ext, ...
+
+            text may only contain letters, as ReadDir and Dataset.get_ordered_path split names
+            into their letters and digits. Returns the index entries of the exported frames"""
+            if not text.isalpha():
+                raise ValueError(f"Image name text {text!r} may only contain letters")
+            frames, index = Packages.FrameRecorder.load(path)
+            os.makedirs(target_dir, exist_ok=True)
+            for i, frame in enumerate(frames):
+                if not cv2.imwrite(os.path.join(target_dir, text + str(i) + ext), frame):
+                    raise IOError(f"Could not write frame {i} to {target_dir}")
+            return index
+
+        @staticmethod
+        def _preallocate(file_name):
+            """Reserves the disk blocks of a sparse file so writing never has to"""
+            if hasattr(os, "posix_fallocate"):
+                with open(file_name, "r+b") as f:
+                    os.posix_fallocate(f.fileno(), 0, os.fstat(f.fileno()).st_size)
+
+        def _write_loop(self):
+            """Copies queued frames into the memory mapped files until None is queued"""
+            while True:
+                entry = self._pending.get()
+                if entry is None:
+                    return
+                record, timestamp, sequence, buffer = entry
+                self._frames[record] = buffer
+                self._index[record] = (timestamp, sequence)
+                self._free.put(buffer)
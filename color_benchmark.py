@@ -0,0 +1,191 @@
+# Copyright (C) 2022  Rohan Dugad
+#
+# Contact info:
+# https://docs.google.com/document/d/17IhBs4cz7FXphE0praCaWMjz016a7BFU5IQbm1CNnUc/edit?usp=sharing
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+#!/usr/bin/env python3
+"""Threshold and processing benchmarks for the ColorTracker
+
+Run with `python -m raspberry_pi_libraries.color_benchmark` to print the results as JSON"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+import numpy as np
+import cv2
+from raspberry_pi_libraries.multi_wrapper import Packages as MultiPackages
+
+class Packages:
+    """Contains the frame generator and the benchmarks"""
+    SIZES = ((640, 480), (320, 240))
+    SCALES = (1, 2, 4)
+    HSV_MAX_VALUES = (179, 255, 255)
+    HSV_BOUNDS = ((0, 20), (100, 255), (100, 255))
+
+    @staticmethod
+    def make_frame(width, height, seed=0):
+        """Returns a BGR frame of noise with a few solid colored blobs"""
+        rng = np.random.default_rng(seed)
+        frame = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+        for color in ((0, 0, 255), (255, 0, 0), (0, 255, 0), (0, 128, 255)):
+            center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+            cv2.circle(frame, center, min(width, height) // 8, color, -1)
+        return frame
+
+    @staticmethod
+    def time_ns(function, repeats):
+        """Returns the fastest of repeats calls of function in nanoseconds"""
+        function()
+        fastest = None
+        for _ in range(repeats):
+            start = time.perf_counter_ns()
+            function()
+            elapsed = time.perf_counter_ns() - start
+            fastest = elapsed if fastest is None else min(fastest, elapsed)
+        return fastest
+
+    @staticmethod
+    def make_lut(lows, highs):
+        """Returns per channel lookup tables holding 255 inside the bounds of the channel"""
+        lut = np.zeros((1, 256, 3), dtype=np.uint8)
+        for channel in range(3):
+            lut[0, lows[channel]:highs[channel] + 1, channel] = 255
+        return lut
+
+    @staticmethod
+    def make_fused_lut(lows, highs, conversion, bits=5):
+        """Returns the tables of a threshold fused with the conversion
+
+        Every channel is quantized to bits and shifted into its bits of a cell index by the
+        first table, and the second table holds the threshold of the center of every cell"""
+        shift = 8 - bits
+        shifts = np.array([2 * bits, bits, 0])
+        values = np.arange(256)[:, np.newaxis]
+        index_lut = ((values >> shift) << shifts).astype(np.uint16).reshape(1, 256, 3)
+
+        cells = np.arange(1 << (3 * bits))[:, np.newaxis]
+        centers = ((cells >> shifts) & ((1 << bits) - 1)) << shift | (1 << shift >> 1)
+        converted = cv2.cvtColor(centers.astype(np.uint8).reshape(1, -1, 3), conversion)
+        return index_lut, cv2.inRange(converted, lows, highs).reshape(-1)
+
+    @staticmethod
+    def threshold(width, height, repeats=50):
+        """Times converting to HSV and thresholding with ColorTracker against lookup tables
+
+        The lookup tables were tried as a faster threshold but lost to cv2.inRange everywhere
+        they were measured, so they only live here to keep that result reproducible"""
+        frame = Packages.make_frame(width, height)
+        tracker = MultiPackages.ColorTracker(Packages.HSV_MAX_VALUES, ("H", "S", "V"),
+                                             "benchmark", Packages.HSV_BOUNDS)
+        reference = tracker.threshold(cv2.cvtColor(frame, cv2.COLOR_BGR2HSV))
+        in_range_ns = Packages.time_ns(
+            lambda: tracker.threshold(cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)), repeats)
+
+        lows, highs = tracker.get_bounds()
+        mask = np.empty(frame.shape[:2], dtype=np.uint8)
+        lut = Packages.make_lut(lows, highs)
+        lut_out = np.empty(frame.shape, dtype=np.uint8)
+        def lut_threshold():
+            cv2.LUT(cv2.cvtColor(frame, cv2.COLOR_BGR2HSV), lut, dst=lut_out)
+            np.bitwise_and(lut_out[..., 0], lut_out[..., 1], out=mask)
+            return np.bitwise_and(mask, lut_out[..., 2], out=mask)
+        lut_ns = Packages.time_ns(lut_threshold, repeats)
+        lut_agreement = float(np.mean(lut_threshold() == reference))
+
+        index_lut, cell_lut = Packages.make_fused_lut(lows, highs, cv2.COLOR_BGR2HSV)
+        index_out = np.empty(frame.shape, dtype=np.uint16)
+        index = np.empty(frame.shape[:2], dtype=np.uint16)
+        index_sum = np.ones((1, 3), dtype=np.float32)
+        def fused_threshold():
+            cv2.LUT(frame, index_lut, dst=index_out)
+            cv2.transform(index_out, index_sum, dst=index)
+            return np.take(cell_lut, index, out=mask)
+        fused_ns = Packages.time_ns(fused_threshold, repeats)
+        fused_agreement = float(np.mean(fused_threshold() == reference))
+        build_ns = Packages.time_ns(
+            lambda: Packages.make_fused_lut(lows, highs, cv2.COLOR_BGR2HSV), repeats)
+        return {
+            "in_range_us": in_range_ns / 1e3,
+            "lut_us": lut_ns / 1e3,
+            "lut_agreement": lut_agreement,
+            "fused_lut_us": fused_ns / 1e3,
+            "fused_lut_agreement": fused_agreement,
+            "fused_lut_build_us": build_ns / 1e3,
+        }
+
+    @staticmethod
+    def processing(width, height, repeats=50, scales=SCALES):
+        """Times processing at every scale and how far its bounding boxes are from scale 1"""
+        frame = cv2.cvtColor(Packages.make_frame(width, height), cv2.COLOR_BGR2HSV)
+        tracker = MultiPackages.ColorTracker(Packages.HSV_MAX_VALUES, ("H", "S", "V"),
+                                             "benchmark", Packages.HSV_BOUNDS)
+        reference = sorted(cv2.boundingRect(contour) for contour in tracker.processing(frame))
+        result = {}
+        for scale in scales:
+            elapsed_ns = Packages.time_ns(lambda: tracker.processing(frame, scale=scale),
+                                          repeats)
+            boxes = sorted(cv2.boundingRect(contour)
+                           for contour in tracker.processing(frame, scale=scale))
+            result[f"processing_scale{scale}_us"] = elapsed_ns / 1e3
+            # Boxes are only compared when no contour was lost or split by the scaling
+            result[f"processing_scale{scale}_contours"] = len(boxes)
+            if len(boxes) == len(reference) and boxes:
+                result[f"processing_scale{scale}_max_box_error_px"] = int(
+                    np.abs(np.array(boxes) - np.array(reference)).max())
+        return result
+
+    @staticmethod
+    def run(sizes=SIZES, repeats=50, scales=SCALES):
+        """Runs every benchmark and returns the results as a JSON serializable dict"""
+        results = []
+        for width, height in sizes:
+            result = {"width": width, "height": height}
+            result.update(Packages.threshold(width, height, repeats))
+            result.update(Packages.processing(width, height, repeats, scales))
+            results.append(result)
+        return {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "machine": platform.machine(),
+            "results": results,
+        }
+
+def main():
+    """Parses arguments, runs the benchmarks and emits JSON"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", nargs="+", default=[f"{w}x{h}" for w, h in Packages.SIZES],
+                        help="frame sizes as WIDTHxHEIGHT")
+    parser.add_argument("--scales", type=int, nargs="+", default=list(Packages.SCALES),
+                        help="processing scales to compare")
+    parser.add_argument("--repeats", type=int, default=50,
+                        help="repetitions per path, the fastest one is reported")
+    parser.add_argument("--output", help="file to write the JSON to instead of stdout")
+    args = parser.parse_args()
+
+    sizes = [tuple(int(value) for value in size.split("x")) for size in args.sizes]
+    report = Packages.run(sizes, args.repeats, args.scales)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+if __name__ == "__main__":
+    main()
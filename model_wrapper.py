@@ -19,6 +19,12 @@
 #!/usr/bin/env python3
 """Model Utilities Library"""
 
+import collections
+import concurrent.futures
+import os
+import queue
+import threading
+import time
 import numpy as np
 import tflite_runtime.interpreter as tflite
 import cv2
@@ -27,44 +33,745 @@ class ModelWrapper:
     """Class containing usage methods of the TFLite model"""
     OBJECT_DETECTION = "object_detection"
     REGRESSION = "regression"
+    # Box is (xmin, ymin, xmax, ymax) in pixels of the frame the detections were scaled to
+    DETECTION_DTYPE = np.dtype([('box', np.int32, 4), ('class', np.int32), ('score', np.float32)])
 
-    def __init__(self, model_path, mode):
+    def __init__(self, model_path, mode, input_mean=0.0, input_std=1.0, num_threads=None,
+                 interpreter=None, warmup=2):
         self._model_path = model_path
         self._mode = mode
+        self._input_mean = input_mean
+        self._input_std = input_std
+        self._pooled = False
 
-        self._interpreter = tflite.Interpreter(model_path=self._model_path)
-        self._interpreter.allocate_tensors()
+        if interpreter is None:
+            interpreter = tflite.Interpreter(model_path=self._model_path, num_threads=num_threads)
+            interpreter.allocate_tensors()
+        self._interpreter = interpreter
 
-        self._input_index = self._interpreter.get_input_details()[0]['index']
+        input_details = self._interpreter.get_input_details()[0]
+        self._input_index = input_details['index']
+        self._input_dtype = np.dtype(input_details['dtype'])
         self._output_details = self._interpreter.get_output_details()
         self._output_index = self._output_details[0]['index']
 
-        _, self._input_height, self._input_width, _ = self._interpreter.get_input_details()[0]['shape']
+        _, self._input_height, self._input_width, self._input_channels = input_details['shape']
+
+        # Accessor for a view of the input tensor, must not be held across invoke()
+        self._input_tensor = self._interpreter.tensor(self._input_index)
+        self._batch_throughput = None
+        self._timings = None
+        self._cache = None
+
+        # Resize target when the input tensor is not uint8 and needs a dtype conversion
+        self._resized = np.empty((self._input_height, self._input_width, self._input_channels),
+                                 dtype=np.uint8)
+
+        self.warmup(warmup)
+
+    @classmethod
+    def from_registry(cls, model_path, mode, input_mean=0.0, input_std=1.0, num_threads=None,
+                      timeout=None):
+        """Returns an instance using an interpreter borrowed from ModelRegistry
+
+        The interpreter goes back to the pool when close() is called"""
+        interpreter = ModelRegistry.acquire(model_path, num_threads, timeout)
+        # ModelRegistry already warmed up the interpreter when it was built
+        wrapper = cls(model_path, mode, input_mean, input_std, interpreter=interpreter, warmup=0)
+        wrapper._pooled = True
+        return wrapper
+
+    def close(self):
+        """Returns the interpreter to ModelRegistry if it was borrowed from there"""
+        if self._pooled:
+            self._pooled = False
+            ModelRegistry.release(self._interpreter)
+
+    def warmup(self, invocations=2):
+        """Invokes the interpreter on a blank input so later frames skip the cold start cost"""
+        if invocations:
+            self._input_tensor().fill(0)
+        for _ in range(invocations):
+            self._interpreter.invoke()
+
+    def enable_profiling(self, window=256):
+        """Starts recording the latency of every stage over the last window calls"""
+        self._timings = self._StageTimings(window)
+
+    def disable_profiling(self):
+        """Stops recording stage latencies"""
+        self._timings = None
+
+    def get_stage_latencies(self):
+        """Returns p50, p90, p99 and max latency in microseconds and the sample count per stage"""
+        if self._timings is None:
+            return {}
+        return self._timings.summarize()
+
+    def print_stage_latencies(self):
+        """Prints the latency summary of every stage"""
+        for stage, summary in self.get_stage_latencies().items():
+            print(f"{stage}: p50 {summary['p50']:.1f}us, p90 {summary['p90']:.1f}us, "
+                  f"p99 {summary['p99']:.1f}us, max {summary['max']:.1f}us "
+                  f"({summary['count']} samples)")
+
+    def enable_cache(self, threshold=2.0, max_skip=5, max_age=0.5, size=(16, 12)):
+        """Makes run_inference reuse the previous output while frames barely change
+
+        The signature of a frame is its resized input shrunk to size. When the mean absolute
+        difference to the signature of the frame behind the cached output is at most
+        threshold, the cached output is returned. At most max_skip frames in a row are served
+        from the cache and none once the output is older than max_age seconds"""
+        self._cache = self._ResultCache(threshold, max_skip, max_age, size)
+
+    def disable_cache(self):
+        """Makes run_inference invoke the interpreter for every frame again"""
+        self._cache = None
+
+    def get_cache_stats(self):
+        """Returns the hit and miss counts of the result cache"""
+        if self._cache is None:
+            return {'hits': 0, 'misses': 0}
+        return self._cache.get_stats()
+
+    def preprocess(self, raw_image, row=0):
+        """Resizes and converts the image straight into a row of the interpreter's input tensor"""
+        # cv2.resize silently writes into a new array instead of dst when the channels or the
+        # dtype differ, which would leave the previous frame in the input tensor
+        channels = raw_image.shape[2] if raw_image.ndim == 3 else 1
+        if raw_image.ndim not in (2, 3) or channels != self._input_channels:
+            raise ValueError(f"Expected an image with {self._input_channels} channels, got "
+                             f"shape {raw_image.shape}")
+        if raw_image.dtype != np.uint8:
+            raise ValueError(f"Expected a uint8 image, got {raw_image.dtype}")
+        timings = self._timings
+        if timings is not None:
+            start = time.perf_counter_ns()
+        input_tensor = self._input_tensor()[row]
+        if self._input_dtype == np.uint8:
+            cv2.resize(raw_image, (self._input_width, self._input_height), dst=input_tensor)
+            if timings is not None:
+                timings.record(timings.RESIZE, start)
+        else:
+            cv2.resize(raw_image, (self._input_width, self._input_height), dst=self._resized)
+            if timings is not None:
+                start = timings.record(timings.RESIZE, start)
+            if self._input_mean == 0.0 and self._input_std == 1.0:
+                np.copyto(input_tensor, self._resized, casting='unsafe')
+            else:
+                np.subtract(self._resized, self._input_mean, out=input_tensor,
+                            dtype=input_tensor.dtype, casting='unsafe')
+                np.divide(input_tensor, self._input_std, out=input_tensor,
+                          dtype=input_tensor.dtype, casting='unsafe')
+            if timings is not None:
+                timings.record(timings.CONVERT, start)
 
     def run_inference(self, raw_image):
         """Invokes interpreter on image"""
-        image = cv2.resize(raw_image, (self._input_width, self._input_height))
+        self.preprocess(raw_image)
+        cache = self._cache
+        if cache is None:
+            return self.invoke()
+        # The input tensor view is only a temporary so it is released before invoke()
+        if cache.check(self._input_tensor()[0] if self._input_dtype == np.uint8
+                       else self._resized):
+            return cache.get_output()
+        return cache.store(self.invoke())
 
-        if self._mode == self.REGRESSION:
-            image = np.expand_dims(image, axis=0).astype(np.float32)
-        elif self._mode == self.OBJECT_DETECTION:
-            image = np.round(np.expand_dims(image, axis=0)).astype(np.uint8)
+    def invoke(self):
+        """Invokes interpreter on the input tensor filled in by preprocess and returns its outputs"""
+        return self._invoke_batch(1)[0]
+
+    def run_batch(self, images, batch_size=8, decode_threads=2):
+        """Yields the inference output of every image in order
+
+        images is any iterable of images or image paths, for example the paths from
+        Dataset.get_ordered_path joined to their directory or ReadDir.get_images(). Paths are
+        decoded on decode_threads worker threads. The input tensor is resized to batch_size
+        images if the model allows it, otherwise images are invoked one at a time. The
+        throughput so far is available from get_batch_throughput"""
+        batch_size = self._resize_batch(batch_size)
+        start = time.perf_counter()
+        image_num = 0
+        try:
+            with concurrent.futures.ThreadPoolExecutor(decode_threads) as executor:
+                decoded = self._decode_ahead(images, executor, 2 * batch_size)
+                while True:
+                    count = 0
+                    for image in decoded:
+                        self.preprocess(image, count)
+                        count += 1
+                        if count == batch_size:
+                            break
+                    if not count:
+                        break
+                    for output in self._invoke_batch(count):
+                        image_num += 1
+                        self._batch_throughput = image_num / (time.perf_counter() - start)
+                        yield output
+        finally:
+            self._resize_batch(1)
 
-        self._interpreter.set_tensor(self._input_index, image)
+    def get_batch_throughput(self):
+        """Returns images per second of the latest run_batch or None if it was never run"""
+        return self._batch_throughput
+
+    @staticmethod
+    def _decode_ahead(images, executor, prefetch):
+        """Yields images in order while up to prefetch paths are decoded in the executor"""
+        pending = collections.deque()
+        for image in images:
+            if isinstance(image, (str, os.PathLike)):
+                image = os.fspath(image)
+                pending.append((image, executor.submit(cv2.imread, image)))
+            else:
+                pending.append((None, image))
+            if len(pending) >= prefetch:
+                yield ModelWrapper._take_decoded(*pending.popleft())
+        while pending:
+            yield ModelWrapper._take_decoded(*pending.popleft())
+
+    @staticmethod
+    def _take_decoded(path, image):
+        """Returns an image queued by _decode_ahead, waiting for it to be decoded if needed"""
+        if path is None:
+            return image
+        image = image.result()
+        if image is None:
+            raise FileNotFoundError(f"Could not decode {path}")
+        return image
+
+    def _resize_batch(self, batch_size):
+        """Resizes the input tensor to batch_size images and returns the batch size in effect"""
+        if self._input_tensor().shape[0] == batch_size:
+            return batch_size
+        shape = [batch_size, self._input_height, self._input_width, self._input_channels]
+        try:
+            self._interpreter.resize_tensor_input(self._input_index, shape)
+            self._interpreter.allocate_tensors()
+        except (ValueError, RuntimeError):
+            if batch_size == 1:
+                raise
+            return self._resize_batch(1)
+        return batch_size
+
+    def _invoke_batch(self, count):
+        """Invokes the interpreter and returns the outputs of the first count images"""
+        timings = self._timings
+        if timings is None:
+            self._interpreter.invoke()
+            return self._get_outputs(count)
+        start = time.perf_counter_ns()
         self._interpreter.invoke()
+        start = timings.record(timings.INVOKE, start)
+        outputs = self._get_outputs(count)
+        timings.record(timings.OUTPUTS, start)
+        return outputs
 
+    def _get_outputs(self, count):
+        """Returns the outputs of the first count images of the batch"""
         if self._mode == self.REGRESSION:
-            return self._interpreter.get_tensor(self._output_index)[0][0]
+            output = self._interpreter.get_tensor(self._output_index)
+            return [output[i][0] for i in range(count)]
         elif self._mode == self.OBJECT_DETECTION:
-            boxes = self._interpreter.get_tensor(self._output_details[0]['index'])[0]
-            classes = self._interpreter.get_tensor(self._output_details[1]['index'])[0]
-            scores = self._interpreter.get_tensor(self._output_details[2]['index'])[0]
-            num = self._interpreter.get_tensor(self._output_details[3]['index'])[0]
+            boxes = self._interpreter.get_tensor(self._output_details[0]['index'])
+            classes = self._interpreter.get_tensor(self._output_details[1]['index'])
+            scores = self._interpreter.get_tensor(self._output_details[2]['index'])
+            num = self._interpreter.get_tensor(self._output_details[3]['index'])
 
-            return {'boxes': boxes, 'classes': classes, 'scores': scores, 'num': num}
+            return [{'boxes': boxes[i], 'classes': classes[i], 'scores': scores[i], 'num': num[i]}
+                    for i in range(count)]
 
     def get_box(self, box):
         return ((int(box[1] * self._input_width),
                  int(box[0] * self._input_height)),
                 (int(box[3] * self._input_width),
-                 int(box[2] * self._input_height)))
\ No newline at end of file
+                 int(box[2] * self._input_height)))
+
+    def detect(self, raw_image, score_threshold=0.5, classes=None, nms_threshold=None):
+        """Runs inference on image and returns its postprocessed detections"""
+        height, width = raw_image.shape[:2]
+        return self.postprocess(self.run_inference(raw_image), (width, height), score_threshold,
+                                classes, nms_threshold)
+
+    def postprocess(self, outputs, frame_size=None, score_threshold=0.5, classes=None,
+                    nms_threshold=None):
+        """Filters and scales object detection outputs into an array of DETECTION_DTYPE
+
+        frame_size is the (width, height) boxes are scaled to and defaults to the input size.
+        classes is an optional collection of class ids to keep. When nms_threshold is given,
+        boxes overlapping a higher scoring box of the same class by more IoU are removed.
+        Detections are sorted by descending score"""
+        if frame_size is None:
+            frame_size = (self._input_width, self._input_height)
+        num = int(outputs['num'])
+        scores = outputs['scores'][:num]
+        class_ids = outputs['classes'][:num].astype(np.int32)
+
+        keep = scores >= score_threshold
+        if classes is not None:
+            keep &= np.isin(class_ids, np.fromiter(classes, dtype=np.int32))
+        keep = np.flatnonzero(keep)
+        keep = keep[np.argsort(-scores[keep], kind='stable')]
+
+        # Model boxes are normalized (ymin, xmin, ymax, xmax)
+        width, height = frame_size
+        boxes = outputs['boxes'][keep][:, [1, 0, 3, 2]] * np.array([width, height, width, height])
+        np.clip(boxes, 0, [width, height, width, height], out=boxes)
+
+        if nms_threshold is not None and len(keep) > 1:
+            selected = self._non_max_suppression(boxes, class_ids[keep], nms_threshold)
+            keep = keep[selected]
+            boxes = boxes[selected]
+
+        detections = np.empty(len(keep), dtype=self.DETECTION_DTYPE)
+        detections['box'] = boxes
+        detections['class'] = class_ids[keep]
+        detections['score'] = scores[keep]
+        return detections
+
+    @staticmethod
+    def _non_max_suppression(boxes, class_ids, nms_threshold):
+        """Returns indices of the boxes, sorted by descending score, that survive per class NMS"""
+        # Shifting every class into its own region keeps boxes of different classes apart
+        offsets = class_ids[:, np.newaxis] * (boxes.max() + 1)
+        shifted = boxes + offsets
+        areas = (shifted[:, 2] - shifted[:, 0]) * (shifted[:, 3] - shifted[:, 1])
+
+        order = np.arange(len(shifted))
+        selected = []
+        while len(order):
+            best, order = order[0], order[1:]
+            selected.append(best)
+            width = (np.minimum(shifted[best, 2], shifted[order, 2])
+                     - np.maximum(shifted[best, 0], shifted[order, 0])).clip(0)
+            height = (np.minimum(shifted[best, 3], shifted[order, 3])
+                      - np.maximum(shifted[best, 1], shifted[order, 1])).clip(0)
+            intersection = width * height
+            union = areas[best] + areas[order] - intersection
+            order = order[intersection <= nms_threshold * union]
+        return np.array(selected, dtype=np.intp)
+
+    class _StageTimings:
+        """Ring buffers of the latest perf_counter_ns durations of every inference stage"""
+        RESIZE, CONVERT, INVOKE, OUTPUTS = range(4)
+        STAGES = ("resize", "convert", "invoke", "outputs")
+
+        def __init__(self, window):
+            self._window = window
+            self._samples = np.zeros((len(self.STAGES), window), dtype=np.int64)
+            self._counts = [0] * len(self.STAGES)
+
+        def record(self, stage, start):
+            """Records the time since start for stage and returns the current time"""
+            now = time.perf_counter_ns()
+            count = self._counts[stage]
+            self._samples[stage, count % self._window] = now - start
+            self._counts[stage] = count + 1
+            return now
+
+        def summarize(self):
+            """Returns the latency summary of every stage that has samples"""
+            summary = {}
+            for stage, name in enumerate(self.STAGES):
+                count = min(self._counts[stage], self._window)
+                if not count:
+                    continue
+                samples = self._samples[stage, :count] / 1e3
+                p50, p90, p99 = np.percentile(samples, (50, 90, 99))
+                summary[name] = {'p50': p50, 'p90': p90, 'p99': p99, 'max': samples.max(),
+                                 'count': self._counts[stage]}
+            return summary
+
+    class _ResultCache:
+        """Last inference output along with the signature of the frame that produced it"""
+        def __init__(self, threshold, max_skip, max_age, size):
+            self._threshold = threshold
+            self._max_skip = max_skip
+            self._max_age = max_age
+            self._size = size
+            self._signature = None
+            self._candidate = None
+            self._output = None
+            self._stored_at = 0.0
+            self._skipped = 0
+            self._hits = 0
+            self._misses = 0
+
+        def check(self, resized):
+            """Computes the signature of the resized input and returns whether the cached
+            output can be reused for it"""
+            if self._candidate is None or self._candidate.shape[2:] != resized.shape[2:]:
+                self._candidate = cv2.resize(resized, self._size, interpolation=cv2.INTER_AREA)
+            else:
+                cv2.resize(resized, self._size, dst=self._candidate, interpolation=cv2.INTER_AREA)
+
+            if (self._output is not None and self._skipped < self._max_skip
+                    and (self._max_age is None
+                         or time.perf_counter() - self._stored_at < self._max_age)
+                    and self._signature.shape == self._candidate.shape
+                    and cv2.norm(self._candidate, self._signature, cv2.NORM_L1)
+                    <= self._threshold * self._candidate.size):
+                self._skipped += 1
+                self._hits += 1
+                return True
+            self._misses += 1
+            return False
+
+        def store(self, output):
+            """Caches the output of the frame last passed to check and returns it"""
+            self._signature, self._candidate = self._candidate, self._signature
+            self._output = output
+            self._stored_at = time.perf_counter()
+            self._skipped = 0
+            return output
+
+        def get_output(self):
+            """Returns the cached output"""
+            return self._output
+
+        def get_stats(self):
+            """Returns the hit and miss counts"""
+            return {'hits': self._hits, 'misses': self._misses}
+
+class ModelRegistry:
+    """Process wide cache that loads every model file once and pools ready interpreters
+
+    Interpreters are pooled per model file and num_threads, at most pool_size of each. When the
+    estimated memory of the loaded models exceeds the budget, the least recently used models
+    that have no interpreter in use are evicted"""
+    _models = {}
+    _owners = {}
+    _condition = threading.Condition()
+    _pool_size = 1
+    _num_threads = None
+    _memory_budget = None
+    _warmup = 2
+
+    @classmethod
+    def configure(cls, pool_size=1, num_threads=None, memory_budget=None, warmup=2):
+        """Sets the interpreters per pool, the default num_threads, the budget in bytes and the
+        warm-up invocations of every new interpreter"""
+        with cls._condition:
+            cls._pool_size = pool_size
+            cls._num_threads = num_threads
+            cls._memory_budget = memory_budget
+            cls._warmup = warmup
+            cls._evict_over_budget()
+            cls._condition.notify_all()
+
+    @classmethod
+    def acquire(cls, model_path, num_threads=None, timeout=None):
+        """Returns a ready interpreter for the model, waiting while its pool is exhausted"""
+        if num_threads is None:
+            num_threads = cls._num_threads
+        with cls._condition:
+            model = cls._load(model_path)
+            pool = model.get_pool(num_threads)
+            # Counted as in use while waiting too, so the model cannot be evicted meanwhile
+            model.in_use += 1
+            if not cls._condition.wait_for(
+                    lambda: pool.idle or pool.created < cls._pool_size, timeout):
+                model.in_use -= 1
+                cls._evict_over_budget()
+                raise TimeoutError(f"No interpreter of {model_path} became available")
+            model.last_used = time.monotonic()
+            if pool.idle:
+                return pool.idle.pop()
+            pool.created += 1
+
+        # Building the interpreter is slow, so other models can be acquired meanwhile
+        try:
+            interpreter = tflite.Interpreter(model_content=model.content, num_threads=num_threads)
+            interpreter.allocate_tensors()
+            for _ in range(cls._warmup):
+                interpreter.invoke()
+        except Exception:
+            with cls._condition:
+                pool.created -= 1
+                model.in_use -= 1
+                cls._condition.notify_all()
+            raise
+
+        with cls._condition:
+            cls._owners[interpreter] = (model, pool)
+            model.memory += cls._estimate_memory(interpreter)
+            cls._evict_over_budget()
+        return interpreter
+
+    @classmethod
+    def release(cls, interpreter):
+        """Returns an interpreter obtained from acquire to its pool"""
+        with cls._condition:
+            model, pool = cls._owners[interpreter]
+            pool.idle.append(interpreter)
+            model.in_use -= 1
+            model.last_used = time.monotonic()
+            cls._evict_over_budget()
+            cls._condition.notify_all()
+
+    @classmethod
+    def preload(cls, model_path, num_threads=None):
+        """Fills the pool of the model so later acquires do not pay for building interpreters"""
+        interpreters = []
+        try:
+            while len(interpreters) < cls._pool_size:
+                interpreters.append(cls.acquire(model_path, num_threads))
+        finally:
+            for interpreter in interpreters:
+                cls.release(interpreter)
+
+    @classmethod
+    def evict(cls, model_path=None):
+        """Evicts the model, or every model, that has no interpreter in use"""
+        with cls._condition:
+            keys = [cls._key(model_path)] if model_path is not None else list(cls._models)
+            for key in keys:
+                model = cls._models.get(key)
+                if model is not None and not model.in_use:
+                    cls._drop(key)
+
+    @classmethod
+    def get_memory_usage(cls):
+        """Returns the estimated bytes held by loaded models and their interpreters"""
+        with cls._condition:
+            return sum(model.memory for model in cls._models.values())
+
+    @classmethod
+    def get_loaded_models(cls):
+        """Returns the paths of the models that are currently loaded"""
+        with cls._condition:
+            return list(cls._models)
+
+    @staticmethod
+    def _key(model_path):
+        """Returns the key a model file is cached under"""
+        return os.path.abspath(model_path)
+
+    @classmethod
+    def _load(cls, model_path):
+        """Returns the cached model, reading the model file the first time
+
+        The budget is only enforced once the caller has accounted for its interpreter, otherwise
+        the model could evict itself before it is used"""
+        key = cls._key(model_path)
+        model = cls._models.get(key)
+        if model is None:
+            with open(key, "rb") as f:
+                model = cls._Model(f.read())
+            cls._models[key] = model
+        return model
+
+    @classmethod
+    def _drop(cls, key):
+        """Forgets a model along with its idle interpreters"""
+        model = cls._models.pop(key)
+        for pool in model.pools.values():
+            for interpreter in pool.idle:
+                del cls._owners[interpreter]
+
+    @classmethod
+    def _evict_over_budget(cls):
+        """Evicts the least recently used idle models until the memory budget is met"""
+        if cls._memory_budget is None:
+            return
+        idle = sorted((model.last_used, key) for key, model in cls._models.items()
+                      if not model.in_use)
+        usage = sum(model.memory for model in cls._models.values())
+        for _, key in idle:
+            if usage <= cls._memory_budget:
+                break
+            usage -= cls._models[key].memory
+            cls._drop(key)
+
+    @staticmethod
+    def _estimate_memory(interpreter):
+        """Returns the bytes taken by every tensor of the interpreter"""
+        return sum(int(np.prod(tensor['shape'])) * np.dtype(tensor['dtype']).itemsize
+                   for tensor in interpreter.get_tensor_details())
+
+    class _Model:
+        """Model file contents along with its interpreter pools"""
+        def __init__(self, content):
+            self.content = content
+            self.pools = {}
+            self.memory = len(content)
+            self.in_use = 0
+            self.last_used = time.monotonic()
+
+        def get_pool(self, num_threads):
+            """Returns the pool of interpreters using num_threads"""
+            pool = self.pools.get(num_threads)
+            if pool is None:
+                pool = self.pools[num_threads] = ModelRegistry._Pool()
+            return pool
+
+    class _Pool:
+        """Idle interpreters and how many were created"""
+        def __init__(self):
+            self.idle = []
+            self.created = 0
+
+class ModelPipeline:
+    """Overlaps capturing frames with preprocessing and inference of earlier frames
+
+    Every worker thread owns its own ModelWrapper so that several interpreters can invoke at
+    once. Submitted frames are copied into preallocated buffers, so the caller may keep reusing
+    its frame buffer. Results are (frame_id, timestamp, output) tuples in completion order."""
+    def __init__(self, model_path, mode, worker_num=2, num_threads=1, maxsize=2,
+                 drop_stale=True, input_mean=0.0, input_std=1.0, poll_interval=0.1):
+        self._models = [ModelWrapper(model_path, mode, input_mean, input_std, num_threads)
+                        for _ in range(worker_num)]
+        self._drop_stale = drop_stale
+        self._poll_interval = poll_interval
+
+        self._inputs = queue.Queue(maxsize)
+        self._results = queue.Queue(maxsize)
+        # Frames can be queued, preprocessed by every worker and being filled by submit at once
+        self._buffers = queue.Queue()
+        self._buffer_limit = maxsize + worker_num + 1
+        self._buffer_num = 0
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+        self._frame_id = 0
+        self._last_frame_id = -1
+        self._dropped = 0
+
+    def start(self, source=None):
+        """Starts the workers and, if source is given, a capture thread submitting source()"""
+        if self._threads:
+            raise RuntimeError("Pipeline is already running")
+        self._stop.clear()
+        self._threads = [threading.Thread(target=self._work, args=(model,), daemon=True)
+                         for model in self._models]
+        if source is not None:
+            self._threads.append(threading.Thread(target=self._capture, args=(source,),
+                                                  daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        """Stops every thread and discards frames and results that are still queued"""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        for pending in (self._inputs, self._results):
+            while not pending.empty():
+                entry = pending.get_nowait()
+                if pending is self._inputs:
+                    self._buffers.put(entry[2])
+
+    def submit(self, raw_image, timestamp=None):
+        """Queues a copy of the frame for inference and returns its frame id
+
+        When the queue is full the oldest queued frame is dropped if drop_stale is set,
+        otherwise this blocks until a worker takes a frame"""
+        if timestamp is None:
+            timestamp = time.perf_counter()
+        buffer = self._take_buffer(raw_image)
+        np.copyto(buffer, raw_image)
+
+        with self._lock:
+            frame_id = self._frame_id
+            self._frame_id += 1
+        self._put(self._inputs, (frame_id, timestamp, buffer))
+        return frame_id
+
+    def get_result(self, block=True, timeout=None):
+        """Returns the next (frame_id, timestamp, output) tuple or None if there is none
+
+        Errors raised by the workers or the capture thread are raised again here. When
+        drop_stale is set, results that were overtaken by a newer frame are skipped"""
+        while True:
+            try:
+                entry = self._results.get(block, timeout)
+            except queue.Empty:
+                return None
+            if isinstance(entry, BaseException):
+                raise entry
+            if self._drop_stale and entry[0] < self._last_frame_id:
+                with self._lock:
+                    self._dropped += 1
+                continue
+            self._last_frame_id = entry[0]
+            return entry
+
+    def get_dropped_frames(self):
+        """Returns how many frames or results were dropped to keep latency bounded"""
+        return self._dropped
+
+    def get_models(self):
+        """Returns the ModelWrapper owned by every worker"""
+        return self._models
+
+    def _take_buffer(self, raw_image):
+        """Returns a free frame buffer matching raw_image, allocating up to the buffer limit"""
+        try:
+            buffer = self._buffers.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                allocate = self._buffer_num < self._buffer_limit
+                self._buffer_num += allocate
+            buffer = np.empty_like(raw_image) if allocate else self._buffers.get()
+        if buffer.shape != raw_image.shape or buffer.dtype != raw_image.dtype:
+            buffer = np.empty_like(raw_image)
+        return buffer
+
+    def _put(self, pending, entry):
+        """Puts entry into one of the queues, dropping the oldest entry if drop_stale is set"""
+        while not self._stop.is_set():
+            if self._drop_stale:
+                try:
+                    pending.put_nowait(entry)
+                    return
+                except queue.Full:
+                    pass
+                try:
+                    stale = pending.get_nowait()
+                except queue.Empty:
+                    continue
+                if isinstance(stale, BaseException):
+                    # Errors are never dropped, the entry being put is dropped instead
+                    stale, entry = entry, stale
+                if pending is self._inputs:
+                    self._buffers.put(stale[2])
+                with self._lock:
+                    self._dropped += 1
+            else:
+                try:
+                    pending.put(entry, timeout=self._poll_interval)
+                    return
+                except queue.Full:
+                    continue
+        if pending is self._inputs:
+            self._buffers.put(entry[2])
+
+    def _work(self, model):
+        """Preprocesses and runs inference on queued frames until the pipeline is stopped"""
+        while not self._stop.is_set():
+            try:
+                frame_id, timestamp, buffer = self._inputs.get(timeout=self._poll_interval)
+            except queue.Empty:
+                continue
+            try:
+                try:
+                    model.preprocess(buffer)
+                finally:
+                    # The frame is in the input tensor now so the buffer can be refilled
+                    self._buffers.put(buffer)
+                entry = (frame_id, timestamp, model.invoke())
+            except Exception as e:
+                entry = e
+            self._put(self._results, entry)
+
+    def _capture(self, source):
+        """Submits frames returned by source until it raises or the pipeline is stopped"""
+        while not self._stop.is_set():
+            try:
+                self.submit(source())
+            except Exception as e:
+                self._put(self._results, e)
+                return
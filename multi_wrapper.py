@@ -20,6 +20,7 @@
 """This script contains all of the base modules used in this directory"""
 
 import os
+import copy
 import datetime
 import time
 import queue
@@ -257,13 +258,28 @@ class Packages:
                 return self._mode
 
     class Fps:
-        """Computes Fps over a series of frames and their times"""
-        def __init__(self):
+        """Computes Fps over a rolling window of frames and their times"""
+        PERCENTILES = (50, 95, 99)
+
+        def __init__(self, window=120, smoothing=0.1, warmup=1):
+            if window < 2:
+                raise ValueError("window must hold at least 2 frame times")
             self._timer = Packages.Timer()
-            self._elapsed_times = np.array([])
+            self._elapsed_times = np.zeros(window)
+            self._index = 0
+            self._count = 0
+            self._warmup = warmup
+            self._skipped = 0
+            self._smoothing = smoothing
+            self._ema = None
+            self._total_count = 0
+            self._total_mean = 0.0
+            self._total_m2 = 0.0
             self._ms_to_seconds = 1.0/1000000.0
             self._mean = None
             self._fps = None
+            self._percentiles = None
+            self._jitter = None
 
         def open_timer(self):
             """Starts timer that determines the elapsed time"""
@@ -272,31 +288,116 @@ class Packages:
         def close_timer(self):
             """Stops timer that determines the elapsed time"""
             self._timer.stop()
-            self._elapsed_times = np.append(self._elapsed_times, self._timer.get_elapsed_time())
-            return self._elapsed_times[-1]
+            elapsed_time = self._timer.get_elapsed_time()
+            self.add_time(elapsed_time)
+            return elapsed_time
+
+        def add_time(self, elapsed_time):
+            """Records a frame time in seconds, the first warmup frames are ignored"""
+            if self._skipped < self._warmup:
+                self._skipped += 1
+                return
+            self._elapsed_times[self._index] = elapsed_time
+            self._index = (self._index + 1) % len(self._elapsed_times)
+            self._count = min(self._count + 1, len(self._elapsed_times))
+
+            if self._ema is None:
+                self._ema = elapsed_time
+            else:
+                self._ema += self._smoothing * (elapsed_time - self._ema)
+            # Welford's update keeps the all time mean and variance without storing history
+            self._total_count += 1
+            delta = elapsed_time - self._total_mean
+            self._total_mean += delta / self._total_count
+            self._total_m2 += delta * (elapsed_time - self._total_mean)
 
         def calculate(self):
-            """Calculates the fps based upon a series of stats"""
-            self._elapsed_times = np.delete(self._elapsed_times, [0])
-            self._mean = np.mean(self._elapsed_times)
+            """Calculates the fps and frame time stats over the current window"""
+            if self._count == 0:
+                return
+            elapsed_times = self.get_window()
+            self._mean = float(np.mean(elapsed_times))
             self._fps = 1.0/self._mean
+            self._percentiles = dict(zip(self.PERCENTILES,
+                                         np.percentile(elapsed_times, self.PERCENTILES).tolist()))
+            if len(elapsed_times) > 1:
+                self._jitter = float(np.max(np.abs(np.diff(elapsed_times))))
+            else:
+                self._jitter = 0.0
+
+        def reset(self):
+            """Forgets every recorded frame time"""
+            self._index = 0
+            self._count = 0
+            self._skipped = 0
+            self._ema = None
+            self._total_count = 0
+            self._total_mean = 0.0
+            self._total_m2 = 0.0
+            self._mean = None
+            self._fps = None
+            self._percentiles = None
+            self._jitter = None
 
         def print_fps(self):
             """Prints out just fps"""
             print("FPS: " + str(self._fps))
 
+        def print_stats(self):
+            """Prints out fps and frame time stats in milliseconds"""
+            self.print_fps()
+            if self._percentiles is not None:
+                for percentile, elapsed_time in self._percentiles.items():
+                    print(f"p{percentile}: {elapsed_time * 1000.0:.3f} ms")
+                print(f"jitter: {self._jitter * 1000.0:.3f} ms")
+
         def debug(self, debug):
             """Prints out values of all variables for debugging"""
             if debug:
-                print("elapsedTimes: " + str(self._elapsed_times))
+                print("elapsedTimes: " + str(self.get_window()))
                 print("mean: " + str(self._mean))
                 print("fps: " + str(self._fps))
+                print("percentiles: " + str(self._percentiles))
+                print("jitter: " + str(self._jitter))
+                print("ema: " + str(self._ema))
+                print("total_count: " + str(self._total_count))
                 self._timer.debug(debug)
 
+        def get_window(self):
+            """Returns the frame times of the current window from oldest to newest"""
+            if self._count < len(self._elapsed_times):
+                return self._elapsed_times[:self._count].copy()
+            return np.roll(self._elapsed_times, -self._index)
+
         def get_fps(self):
             """Returns fps"""
             return self._fps
 
+        def get_mean(self):
+            """Returns mean frame time of the window in seconds"""
+            return self._mean
+
+        def get_percentiles(self):
+            """Returns dict of percentile to frame time in seconds"""
+            return self._percentiles
+
+        def get_jitter(self):
+            """Returns largest change between consecutive frame times of the window in seconds"""
+            return self._jitter
+
+        def get_ema_fps(self):
+            """Returns fps from the exponential moving average of the frame times"""
+            if self._ema is None:
+                return None
+            return 1.0/self._ema
+
+        def get_total_stats(self):
+            """Returns count, mean and standard deviation of every frame time since reset"""
+            if self._total_count < 2:
+                return self._total_count, self._total_mean, 0.0
+            return (self._total_count, self._total_mean,
+                    (self._total_m2 / (self._total_count - 1)) ** 0.5)
+
         def time_this(self):
             """Returns an automated timer context manager for usage in 'with' statements"""
             return self._AutomatedTiming(self.open_timer, self.close_timer)
@@ -599,6 +700,9 @@ class Packages:
 
     class ColorTracker:
         """Tracks colors using customizable colorspace and has easy calibration with trackbars"""
+        # Structuring element of the noise removal, the same 3x3 square cv2 uses for None
+        _KERNEL = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+
         def __init__(self, channel_max_values, channel_names, window_detection_name, \
                      channel_bounds):
             self._window_detection_name = window_detection_name
@@ -612,33 +716,121 @@ class Packages:
                                                                 self._window_detection_name,
                                                                 bounds=channel_bounds[i])
 
+            self._last_box = None
+            self._track_counts = {'roi': 0, 'full': 0, 'lost': 0}
+            self._scratch = {}
+
         def create_trackbar(self):
             """Creates the trackbars used for easy calibration"""
             keys = list(self._channels)
             for i in range(self._num_of_channels):
                 self._channels[keys[i]].create_trackbar()
 
-        def processing(self, frame, iterations=2):
-            """Thresholds, removes noise, and returns the contours"""
-            keys = list(self._channels)
-            frame_threshold = cv2.inRange(frame,
-                                        (self._channels[keys[0]].get_low(),
-                                         self._channels[keys[1]].get_low(),
-                                         self._channels[keys[2]].get_low()),
-                                        (self._channels[keys[0]].get_high(),
-                                         self._channels[keys[1]].get_high(),
-                                         self._channels[keys[2]].get_high()))
-            frame_erode = cv2.erode(frame_threshold, None, iterations=iterations)
-            frame_dilate = cv2.dilate(frame_erode, None, iterations=iterations)
-
-            contours, _ = cv2.findContours(frame_dilate.copy(), cv2.RETR_EXTERNAL,
+        def processing(self, frame, iterations=2, offset=(0, 0), scale=1):
+            """Thresholds, removes noise, and returns the contours shifted by offset
+
+            With scale 2 or 4 the frame is shrunk by that factor first and the noise removal
+            iterations are divided by it, trading contour accuracy for speed. Contours are
+            scaled back to full resolution either way"""
+            if scale != 1:
+                size = (frame.shape[1] // scale, frame.shape[0] // scale)
+                scaled = self._get_scratch((size[1], size[0]) + frame.shape[2:], 'scaled')
+                frame = cv2.resize(frame, size, dst=scaled, interpolation=cv2.INTER_NEAREST)
+                iterations = max(round(iterations / scale), 1) if iterations else 0
+            frame_threshold = self.threshold(frame, self._get_scratch(frame.shape[:2], 'mask'))
+            frame_erode = cv2.erode(frame_threshold, self._KERNEL, iterations=iterations,
+                                    dst=self._get_scratch(frame.shape[:2], 'eroded'))
+            frame_dilate = cv2.dilate(frame_erode, self._KERNEL, iterations=iterations,
+                                      dst=frame_threshold)
+
+            # findContours no longer modifies its input and returns new contours every call
+            if scale == 1:
+                contours, _ = cv2.findContours(frame_dilate, cv2.RETR_EXTERNAL,
+                                            cv2.CHAIN_APPROX_SIMPLE, offset=offset)
+                return contours
+            contours, _ = cv2.findContours(frame_dilate, cv2.RETR_EXTERNAL,
                                         cv2.CHAIN_APPROX_SIMPLE)
-            return contours.copy()
+            for contour in contours:
+                # Points land in the middle of the block of pixels they were shrunk from
+                contour *= scale
+                contour += (offset[0] + scale // 2, offset[1] + scale // 2)
+            return contours
+
+        def track(self, frame, iterations=2, margin=0.5, min_margin=16, search_scale=1):
+            """Returns the contours of the tracked color, searching near its last position first
+
+            The last bounding box of the largest contour is grown by margin times its size, and
+            at least min_margin pixels, on every side and only that region is processed. When
+            nothing is found there, or nothing was tracked yet, the whole frame is processed at
+            search_scale. Contours are in frame coordinates and get_track_counts tells how often
+            each search was taken"""
+            if self._last_box is not None:
+                x, y, width, height = self._last_box
+                grow_x = max(int(width * margin), min_margin)
+                grow_y = max(int(height * margin), min_margin)
+                left, top = max(x - grow_x, 0), max(y - grow_y, 0)
+                right = min(x + width + grow_x, frame.shape[1])
+                bottom = min(y + height + grow_y, frame.shape[0])
+                contours = self.processing(frame[top:bottom, left:right], iterations,
+                                           (left, top))
+                if contours:
+                    self._track_counts['roi'] += 1
+                    self._last_box = cv2.boundingRect(max(contours, key=cv2.contourArea))
+                    return contours
+
+            contours = self.processing(frame, iterations, scale=search_scale)
+            if contours:
+                self._track_counts['full'] += 1
+                self._last_box = cv2.boundingRect(max(contours, key=cv2.contourArea))
+            else:
+                self._track_counts['lost'] += 1
+                self._last_box = None
+            return contours
+
+        def reset_tracking(self):
+            """Forgets the last position so the next track searches the whole frame"""
+            self._last_box = None
+
+        def get_track_counts(self):
+            """Returns how many track calls found the color in the region of its last position,
+            found it in the whole frame, or lost it"""
+            return dict(self._track_counts)
+
+        def get_last_box(self):
+            """Returns the (x, y, width, height) of the tracked contour or None if it was lost"""
+            return self._last_box
+
+        def _get_scratch(self, shape, name):
+            """Returns a view of the scratch image called name with the given shape
+
+            The image only grows, so regions of a frame reuse the buffer of the whole frame"""
+            scratch = self._scratch.get(name)
+            if scratch is None or any(needed > size for needed, size in zip(shape, scratch.shape)):
+                if scratch is not None and scratch.ndim == len(shape):
+                    shape = tuple(map(max, shape, scratch.shape))
+                scratch = self._scratch[name] = np.empty(shape, dtype=np.uint8)
+            return scratch[tuple(slice(size) for size in shape)]
+
+        def threshold(self, frame, dst=None):
+            """Returns the mask of the pixels inside the bounds of every channel, written into
+            dst if given"""
+            lows, highs = self.get_bounds()
+            return cv2.inRange(frame, lows, highs, dst=dst)
+
+        def get_bounds(self):
+            """Returns the lower and higher bounds of every channel"""
+            channels = list(self._channels.values())
+            return (tuple(channel.get_low() for channel in channels),
+                    tuple(channel.get_high() for channel in channels))
 
         def get_channels(self):
             """Returns a deepcopy of the channels of the colorspace"""
             return copy.deepcopy(self._channels)
 
+        def get_window_detection_name(self):
+            """Returns the name of the window holding the trackbars"""
+            return self._window_detection_name
+
         class _Channel:
             """Allows individual manipulation of the channels"""
             def __init__(self, max_value, name, window_detection_name, bounds=()):
@@ -683,3 +875,89 @@ class Packages:
             def get_max_value(self):
                 """Returns max value of the channel"""
                 return self._max_value
+
+    class MultiColorTracker:
+        """Tracks the colors of up to 8 ColorTrackers in a single pass over the frame
+
+        The frame is converted to the colorspace of the trackers once, with the optional cv2
+        conversion code. Every pixel is then classified against all color ranges at once through
+        per channel lookup tables holding one bit per color, so adding colors only adds the
+        morphology and contour search of their masks"""
+        MAX_COLORS = 8
+
+        def __init__(self, trackers, names=None, conversion=None):
+            if len(trackers) > self.MAX_COLORS:
+                raise ValueError(f"At most {self.MAX_COLORS} colors can be tracked at once")
+            self._trackers = list(trackers)
+            if names is None:
+                names = [tracker.get_window_detection_name() for tracker in self._trackers]
+            self._names = list(names)
+            self._conversion = conversion
+            self._bounds = None
+            self._lut = np.zeros((1, 256, 3), dtype=np.uint8)
+            self._shape = None
+
+        def processing(self, frame, iterations=2):
+            """Returns the mask, contours, centroids and areas of every color keyed by name
+
+            Centroids are an (n, 2) array of x, y and areas an (n,) array, one row per contour.
+            The masks are reused by the next call"""
+            if self._shape != frame.shape[:2]:
+                self._allocate(frame.shape[:2])
+            if self._conversion is not None:
+                cv2.cvtColor(frame, self._conversion, dst=self._converted)
+                frame = self._converted
+            cv2.LUT(frame, self._get_lut(), dst=self._bits)
+            np.bitwise_and(self._bits[..., 0], self._bits[..., 1], out=self._labels)
+            np.bitwise_and(self._labels, self._bits[..., 2], out=self._labels)
+
+            results = {}
+            for i, name in enumerate(self._names):
+                mask = self._masks[i]
+                np.bitwise_and(self._labels, 1 << i, out=mask)
+                cv2.compare(mask, 0, cv2.CMP_NE, dst=mask)
+                cv2.erode(mask, None, dst=self._scratch, iterations=iterations)
+                cv2.dilate(self._scratch, None, dst=mask, iterations=iterations)
+                contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+                centroids = np.empty((len(contours), 2))
+                areas = np.empty(len(contours))
+                for j, contour in enumerate(contours):
+                    moments = cv2.moments(contour)
+                    areas[j] = moments['m00']
+                    if moments['m00']:
+                        centroids[j] = (moments['m10'] / moments['m00'],
+                                        moments['m01'] / moments['m00'])
+                    else:
+                        centroids[j] = contour.reshape(-1, 2).mean(axis=0)
+                results[name] = {'mask': mask, 'contours': contours, 'centroids': centroids,
+                                 'areas': areas}
+            return results
+
+        def get_labels(self):
+            """Returns the per pixel bits of the colors of the last processed frame"""
+            return self._labels
+
+        def get_names(self):
+            """Returns the names of the colors"""
+            return self._names
+
+        def _get_lut(self):
+            """Returns the lookup tables, rebuilding them if any bound changed"""
+            bounds = [tracker.get_bounds() for tracker in self._trackers]
+            if bounds != self._bounds:
+                self._lut.fill(0)
+                for i, (lows, highs) in enumerate(bounds):
+                    for channel in range(3):
+                        self._lut[0, lows[channel]:highs[channel] + 1, channel] |= 1 << i
+                self._bounds = bounds
+            return self._lut
+
+        def _allocate(self, shape):
+            """Allocates the scratch images reused for every frame of this size"""
+            self._shape = shape
+            self._converted = np.empty(shape + (3,), dtype=np.uint8)
+            self._bits = np.empty(shape + (3,), dtype=np.uint8)
+            self._labels = np.empty(shape, dtype=np.uint8)
+            self._scratch = np.empty(shape, dtype=np.uint8)
+            self._masks = np.empty((len(self._names),) + shape, dtype=np.uint8)
@@ -0,0 +1,251 @@
+# Copyright (C) 2022  Rohan Dugad
+#
+# Contact info:
+# https://docs.google.com/document/d/17IhBs4cz7FXphE0praCaWMjz016a7BFU5IQbm1CNnUc/edit?usp=sharing
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+#!/usr/bin/env python3
+"""Throughput and latency benchmarks for the Serial Protocol
+
+Run with `python -m raspberry_pi_libraries.serial_benchmark` to print the results as JSON"""
+
+import argparse
+import json
+import os
+import platform
+import select
+import sys
+import threading
+import time
+import tty
+import numpy as np
+from raspberry_pi_libraries.serial_wrapper import SerialWrapper
+
+class FakeSerial:
+    """In-memory stand-in for serial.Serial where everything written can be read back"""
+    def __init__(self):
+        self._buffer = bytearray()
+        self.timeout = None
+
+    def write(self, data):
+        """Appends data to the loopback buffer"""
+        self._buffer += data
+        return len(data)
+
+    def read(self, size=1):
+        """Returns up to size bytes from the loopback buffer"""
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def reset_input_buffer(self):
+        """Discards everything in the loopback buffer"""
+        self._buffer.clear()
+
+    @property
+    def in_waiting(self):
+        """Returns the number of bytes in the loopback buffer"""
+        return len(self._buffer)
+
+class PtyLoopback:
+    """Pseudo terminal pair whose master end echoes everything back to the slave end"""
+    def __init__(self):
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._master)
+        tty.setraw(self._slave)
+        self._echo = threading.Thread(target=self._echo_loop, daemon=True)
+        self._echo.start()
+
+    def _echo_loop(self):
+        """Writes back whatever arrives on the master end until it is closed"""
+        while True:
+            try:
+                data = os.read(self._master, 4096)
+            except OSError:
+                return
+            if not data:
+                return
+            os.write(self._master, data)
+
+    def get_port(self):
+        """Returns the device path of the slave end"""
+        return os.ttyname(self._slave)
+
+    def close(self):
+        """Closes both ends"""
+        os.close(self._master)
+        os.close(self._slave)
+
+class Packages:
+    """Contains the payload generators and the benchmarks"""
+    MAGNITUDES = ("small", "medium", "large", "negative", "escape_heavy")
+    FRAMINGS = (SerialWrapper.FRAMING_LEGACY, SerialWrapper.FRAMING_BINARY)
+
+    @staticmethod
+    def make_packets(packet_num, packet_size, magnitude, seed=0):
+        """Returns a packet_num x packet_size np.int32 array of items of the given magnitude"""
+        rng = np.random.default_rng(seed)
+        shape = (packet_num, packet_size)
+        if magnitude == "small":
+            return rng.integers(0, 0x1d, shape, dtype=np.int32)
+        elif magnitude == "medium":
+            return rng.integers(-0x8000, 0x8000, shape, dtype=np.int32)
+        elif magnitude == "large":
+            return rng.integers(-0x80000000, 0x7FFFFFFF, shape, dtype=np.int32, endpoint=True)
+        elif magnitude == "negative":
+            return rng.integers(-0x80000000, 0, shape, dtype=np.int32)
+        elif magnitude == "escape_heavy":
+            # Every 5 bit chunk is one of the delimiter or escape values
+            chunks = rng.integers(0x1d, 0x1f, shape + (6,), dtype=np.int32, endpoint=True)
+            return (chunks << (5 * np.arange(6, dtype=np.int32))).sum(axis=2, dtype=np.int32)
+        raise ValueError(f"Unknown magnitude {magnitude!r}")
+
+    @staticmethod
+    def codec(packets, repeats=5, framing=SerialWrapper.FRAMING_LEGACY):
+        """Times encoding and decoding packets through an in-memory link"""
+        link = SerialWrapper.fromSerial(FakeSerial(), max_items=packets.shape[1])
+        link.setFraming(framing)
+        packet_num, packet_size = packets.shape
+        item_num = packet_num * packet_size
+
+        encode_ns = []
+        for _ in range(repeats):
+            start = time.perf_counter_ns()
+            for packet in packets:
+                link.send(packet)
+            encode_ns.append(time.perf_counter_ns() - start)
+            link.getSerial().reset_input_buffer()
+
+        batch_ns = []
+        for _ in range(repeats):
+            start = time.perf_counter_ns()
+            link.sendBatch(packets)
+            batch_ns.append(time.perf_counter_ns() - start)
+            link.getSerial().reset_input_buffer()
+
+        if framing == SerialWrapper.FRAMING_BINARY:
+            wire = SerialWrapper.encodeFrames(packets)
+        else:
+            wire = SerialWrapper.encodeBatch(packets)
+        decode_ns = []
+        for _ in range(repeats):
+            link.getSerial().write(wire)
+            start = time.perf_counter_ns()
+            received = link.receiveAll()
+            decode_ns.append(time.perf_counter_ns() - start)
+            if len(received) != packet_num or not np.array_equal(received, packets):
+                raise RuntimeError("Decoded packets do not match the encoded packets")
+
+        encode_s = min(encode_ns) / 1e9
+        batch_s = min(batch_ns) / 1e9
+        decode_s = min(decode_ns) / 1e9
+        return {
+            "wire_bytes": len(wire),
+            "bytes_per_item": len(wire) / item_num,
+            "encode_us_per_item": encode_s * 1e6 / item_num,
+            "encode_batch_us_per_item": batch_s * 1e6 / item_num,
+            "decode_us_per_item": decode_s * 1e6 / item_num,
+            "encode_packets_per_s": packet_num / encode_s,
+            "decode_packets_per_s": packet_num / decode_s,
+            "round_trip_packets_per_s": packet_num / (encode_s + decode_s),
+            "round_trip_bytes_per_s": len(wire) / (encode_s + decode_s),
+        }
+
+    @staticmethod
+    def latency(packets, baud_rate=115200, timeout=1.0, framing=SerialWrapper.FRAMING_LEGACY):
+        """Times sending every packet over a pty loopback until it is decoded again"""
+        loopback = PtyLoopback()
+        link = SerialWrapper(loopback.get_port(), baud_rate, max_items=packets.shape[1])
+        link.setFraming(framing)
+        fd = link.getSerial().fileno()
+        latencies_ns = np.empty(len(packets), dtype=np.int64)
+        try:
+            for i, packet in enumerate(packets):
+                start = time.perf_counter_ns()
+                link.send(packet)
+                received = []
+                while not received:
+                    if not select.select([fd], [], [], timeout)[0]:
+                        raise TimeoutError("Packet did not come back over the loopback")
+                    received = link.receiveAll()
+                latencies_ns[i] = time.perf_counter_ns() - start
+                if not np.array_equal(received[0], packet):
+                    raise RuntimeError("Received packet does not match the sent packet")
+        finally:
+            link.getSerial().close()
+            loopback.close()
+
+        latencies_us = latencies_ns / 1e3
+        return {
+            "latency_us_p50": float(np.percentile(latencies_us, 50)),
+            "latency_us_p90": float(np.percentile(latencies_us, 90)),
+            "latency_us_p99": float(np.percentile(latencies_us, 99)),
+            "latency_us_max": float(latencies_us.max()),
+        }
+
+    @staticmethod
+    def run(packet_sizes=(1, 4, 16, 64), magnitudes=MAGNITUDES, packet_num=1000,
+            latency_packet_num=200, repeats=5, use_pty=True, framings=FRAMINGS):
+        """Runs every benchmark and returns the results as a JSON serializable dict"""
+        results = []
+        for framing in framings:
+            for packet_size in packet_sizes:
+                for magnitude in magnitudes:
+                    packets = Packages.make_packets(packet_num, packet_size, magnitude)
+                    result = {"framing": framing, "packet_size": packet_size,
+                              "magnitude": magnitude, "packet_num": packet_num}
+                    result.update(Packages.codec(packets, repeats, framing))
+                    if use_pty:
+                        result.update(Packages.latency(packets[:latency_packet_num],
+                                                       framing=framing))
+                    results.append(result)
+        return {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "results": results,
+        }
+
+def main():
+    """Parses arguments, runs the benchmarks and emits JSON"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 4, 16, 64],
+                        help="items per packet")
+    parser.add_argument("--magnitudes", nargs="+", default=list(Packages.MAGNITUDES),
+                        choices=Packages.MAGNITUDES, help="item payloads to use")
+    parser.add_argument("--framings", nargs="+", default=list(Packages.FRAMINGS),
+                        choices=Packages.FRAMINGS, help="framings to use")
+    parser.add_argument("--packets", type=int, default=1000,
+                        help="packets per codec benchmark")
+    parser.add_argument("--latency-packets", type=int, default=200,
+                        help="packets per pty loopback latency benchmark")
+    parser.add_argument("--repeats", type=int, default=5,
+                        help="codec repetitions, the fastest one is reported")
+    parser.add_argument("--no-pty", action="store_true",
+                        help="skip the pty loopback latency benchmark")
+    parser.add_argument("--output", help="file to write the JSON to instead of stdout")
+    args = parser.parse_args()
+
+    report = Packages.run(args.sizes, args.magnitudes, args.packets, args.latency_packets,
+                          args.repeats, not args.no_pty, args.framings)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+if __name__ == "__main__":
+    main()
@@ -19,18 +19,126 @@
 #!/usr/bin/env python3
 """Serial Protocol Library"""
 
+import asyncio
+import binascii
 import enum
+import functools
+import os
+import queue
+import selectors
+import threading
+import time
+import types
 import serial
 import numpy as np
 
+class _defaultInstance:
+    """Method decorator that binds calls made on the class to the instance created by begin"""
+    def __init__(self, method):
+        self._method = method
+        functools.update_wrapper(self, method)
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            instance = owner._default
+            if instance is None:
+                raise AttributeError(f"{owner.__name__}.begin() has not been called yet")
+        return types.MethodType(self._method, instance)
+
 class SerialWrapper:
-    """Class containing usage methods of the Serial Protocol"""
+    """Class containing usage methods of the Serial Protocol
+
+    Every instance is an independent link with its own port and parser state. The methods can also
+    be called on the class itself, in which case they act on the default instance made by begin."""
+    READER_OVERFLOW_DROP_OLDEST = "drop_oldest"
+    READER_OVERFLOW_BLOCK = "block"
+    ERROR_POLICY_RAISE = "raise"
+    ERROR_POLICY_DROP = "drop"
+    # Dropping a packet already resyncs on the next packet delimiter, so both name one policy
+    ERROR_POLICY_RESYNC = ERROR_POLICY_DROP
+    FRAMING_LEGACY = "legacy"
+    FRAMING_BINARY = "binary"
+
+    class SerialError(Exception):
+        """Base class of the errors reported by SerialWrapper
+
+        packets holds the packets receiveAll decoded before the error."""
+        kind = None
+        message = None
+
+        def __init__(self, *args, packets=()):
+            super().__init__(*args)
+            self.packets = list(packets)
+
+    class ItemRangeError(SerialError):
+        """Used to report items that do not fit in 32 bits"""
+        kind = "item_range"
+        message = "Keep items between 0x7FFFFFFF and -0x80000000"
+
+    class PacketOverflowError(SerialError):
+        """Used to report packets with more items than their buffer can hold"""
+        kind = "packet_overflow"
+        message = "Packet length overflow, please allocate more memory"
+
+    class CorruptByteError(SerialError):
+        """Used to report bytes that failed their CRC"""
+        kind = "corrupt_byte"
+        message = "Corrupt byte detected"
+
+    class CorruptFrameError(SerialError):
+        """Used to report binary frames that failed their CRC-16 or could not be unpacked"""
+        kind = "corrupt_frame"
+        message = "Corrupt frame detected"
+
+    __slots__ = ("_serial", "_state", "_itemNum", "_decoder", "_pending", "_intoCount",
+                 "_framing", "_acceptNegotiation", "_held", "_reader", "_readerPackets", "_readerOverflow", "_readerLatest", "_readerDropped",
+                 "_readerStop", "_readerTimeout")
+
+    _default = None
+
+    def __init__(self, serial_port, baud_rate, max_items=256, error_policy=ERROR_POLICY_DROP):
+        self._setup(serial.Serial(serial_port, baud_rate), max_items, error_policy)
+
+    @classmethod
+    def fromSerial(cls, serial_instance, max_items=256, error_policy=ERROR_POLICY_DROP):
+        """Creates a link around an already opened serial.Serial or an object that behaves like
+        one"""
+        link = cls.__new__(cls)
+        link._setup(serial_instance, max_items, error_policy)
+        return link
+
+    def _setup(self, serial_instance, max_items, error_policy):
+        """Initializes the state of a link around serial_instance"""
+        self._serial = serial_instance
+        self._state = self._State.INIT
+        self._itemNum = 0
+        self._decoder = self._Decoder(self, max_items, error_policy)
+        self._pending = b""
+        self._intoCount = -1
+        self._framing = self.FRAMING_LEGACY
+        self._acceptNegotiation = False
+        self._held = []
+        self._reader = None
+        self._readerPackets = queue.Queue()
+        self._readerOverflow = self.READER_OVERFLOW_DROP_OLDEST
+        self._readerLatest = None
+        self._readerDropped = 0
+        self._readerStop = threading.Event()
+        self._readerStop.set()
+        self._readerTimeout = None
 
     @classmethod
-    def begin(cls, serial_port, baud_rate):
-        """Initialized the serial port and defines important data"""
-        cls._serial = serial.Serial(serial_port, baud_rate)
+    def begin(cls, serial_port, baud_rate, max_items=256, error_policy=ERROR_POLICY_DROP):
+        """Initialized the serial port of the default instance and returns it
+
+        max_items bounds the packets returned by receiveAll and the background reader.
+        error_policy is described in setErrorPolicy."""
+        cls._default = cls(serial_port, baud_rate, max_items, error_policy)
+        return cls._default
 
+    @classmethod
+    def _initProtocol(cls):
+        """Defines protocol constants and the lookup tables derived from them"""
         cls._CRC_CALCULATOR = [0,
                                3, 6, 5, 7, 4, 1, 2, 5, 6, 3,
                                0, 2, 1, 4, 7, 1, 2, 7, 4, 6,
@@ -46,90 +154,503 @@ class SerialWrapper:
         cls._CONVERSION = 0x10
         cls._ITEM_BIT_LEN = 5
         cls._MAX_ITEM_BYTES = 7
-        cls._state = cls._State.INIT
-        cls._itemNum = 0
 
-    @classmethod
-    def send(cls, packet):
-        """Sends packet with protocol"""
-        cls._serial.write(cls._PACKET_DELIMITER_BYTE_PCS)
-        for item in packet:
-            if item > 0x7FFFFFFF or item < -0x80000000:
-                while True:
-                    print("[ERROR] ITEM TOO LARGE! KEEP ITEMS BETWEEN 0x7FFFFFFF AND -0x80000000")
+        # Wire byte for every 5 bit value and whether it must be preceded by an escape byte
+        cls._ENCODE_ESCAPED = np.zeros(1 << cls._ITEM_BIT_LEN, dtype=bool)
+        cls._ENCODE_TABLE = np.zeros(1 << cls._ITEM_BIT_LEN, dtype=np.uint8)
+        for value in range(1 << cls._ITEM_BIT_LEN):
+            if value in (cls._PACKET_DELIMITER_BYTE, cls._ITEM_DELIMITER_BYTE, cls._ESCAPE_BYTE):
+                cls._ENCODE_ESCAPED[value] = True
+                cls._ENCODE_TABLE[value] = cls._doCRC(cls._escape(value))
             else:
-                itemByte = item
-                itemBytes = np.zeros(cls._MAX_ITEM_BYTES, dtype=np.uint8)
-                bytesNum = 0
+                cls._ENCODE_TABLE[value] = cls._doCRC(value)
+        cls._ENCODE_SHIFTS = np.arange((cls._MAX_ITEM_BYTES - 1) * cls._ITEM_BIT_LEN, -1,
+                                       -cls._ITEM_BIT_LEN)
 
-                for bytesNum in range(cls._MAX_ITEM_BYTES):
-                    itemBytes[bytesNum] = itemByte & 0x1f
-                    itemByte = itemByte >> cls._ITEM_BIT_LEN
+        # Message of every raw byte for bytes.translate, corrupt bytes map to _CORRUPT_BYTE
+        cls._CORRUPT_BYTE = 0xff
+        cls._DECODE_TABLE = bytes(crc_byte >> 3
+                                  if cls._CRC_CALCULATOR[crc_byte >> 3] == crc_byte & 0x07
+                                  else cls._CORRUPT_BYTE for crc_byte in range(256))
 
-                for bytesNum in range(bytesNum, -1, -1):
-                    if itemBytes[bytesNum] != 0:
-                        break
+        # Binary frames are a dtype code, little endian items and a big endian CRC-16/CCITT, all
+        # COBS encoded and ended with a zero byte
+        cls._BINARY_DTYPES = {1: np.dtype("<i1"), 2: np.dtype("<i2"), 3: np.dtype("<i4"),
+                              4: np.dtype("<f4")}
+        cls._BINARY_CODES = {dtype: code for code, dtype in cls._BINARY_DTYPES.items()}
+        cls._FRAME_DELIMITER = 0x00
+        cls._CRC16_INIT = 0xFFFF
+
+        # Two item control packets used by negotiateFraming
+        cls._FRAMING_REQUEST = 0x7F46524D
+        cls._FRAMING_ACK = 0x7F41434B
+        cls._FRAMING_CODES = {cls.FRAMING_LEGACY: 0, cls.FRAMING_BINARY: 1}
 
-                for byteIndex in range(bytesNum, -1, -1):
-                    cls._write(itemBytes[byteIndex])
+    @_defaultInstance
+    def send(self, packet):
+        """Sends packet with protocol"""
+        self.sendBatch(np.asarray(packet)[np.newaxis])
+
+    @_defaultInstance
+    def sendBatch(self, packets):
+        """Sends every row of a 2D array of packets with a single write"""
+        wire = self._encodeFor(self._framing, packets, self._decoder)
+        if wire:
+            self._serial.write(wire)
+
+    @classmethod
+    def _encodeFor(cls, framing, packets, decoder):
+        """Encodes the packets that pass the range check with the given framing"""
+        if framing == cls.FRAMING_BINARY:
+            return cls.encodeFrames(cls._binaryItems(packets, decoder))
+        return cls.encodeBatch(cls._inRange(packets, decoder))
+
+    @classmethod
+    def _binaryItems(cls, packets, decoder):
+        """Converts packets to a dtype binary frames support, reporting integers that do not fit
+        in 32 bits"""
+        items = np.asarray(packets)
+        if items.dtype.newbyteorder("<") in cls._BINARY_CODES:
+            return items
+        if items.dtype.kind in "iub":
+            return cls._inRange(items, decoder).astype(np.int32)
+        if items.dtype.kind == "f":
+            return items.astype(np.float32)
+        raise TypeError(f"Binary frames do not support {items.dtype}")
+
+    @classmethod
+    def _inRange(cls, packets, decoder):
+        """Reports packets with items that do not fit in 32 bits and returns the others"""
+        items = np.asarray(packets, dtype=np.int64)
+        valid = ((items <= 0x7FFFFFFF) & (items >= -0x80000000)).all(axis=1)
+        if not valid.all():
+            decoder.reportError(cls.ItemRangeError, int(np.count_nonzero(~valid)))
+            items = items[valid]
+        return items
+
+    @classmethod
+    def encode(cls, packet):
+        """Converts packet into the bytes that send would write"""
+        return cls.encodeBatch(np.asarray(packet, dtype=np.int64).reshape(1, -1))
+
+    @classmethod
+    def encodeBatch(cls, packets):
+        """Converts every row of a 2D array of packets into one buffer of consecutive packets"""
+        items = np.asarray(packets, dtype=np.int64)
+        if items.size and (items.max() > 0x7FFFFFFF or items.min() < -0x80000000):
+            raise cls.ItemRangeError(cls.ItemRangeError.message)
+
+        packetNum, itemNum = items.shape
+        itemBytes = (items[:, :, np.newaxis] >> cls._ENCODE_SHIFTS) & 0x1f
+
+        # Leading zero chunks are skipped but every item keeps at least its last chunk
+        significant = itemBytes != 0
+        significant[:, :, -1] = True
+        first = np.argmax(significant, axis=2)
+        kept = np.arange(cls._MAX_ITEM_BYTES) >= first[:, :, np.newaxis]
 
-                cls._serial.write(cls._ITEM_DELIMITER_BYTE_PCS)
-        cls._serial.write(cls._PACKET_DELIMITER_BYTE_PCS)
+        # Each chunk gets an escape slot and a data slot followed by one item delimiter slot
+        slotNum = 2 * cls._MAX_ITEM_BYTES + 1
+        itemSlots = np.empty((packetNum, itemNum, slotNum), dtype=np.uint8)
+        itemSlots[:, :, 0:-1:2] = cls._ESCAPE_BYTE_PCS[0]
+        itemSlots[:, :, 1:-1:2] = cls._ENCODE_TABLE[itemBytes]
+        itemSlots[:, :, -1] = cls._ITEM_DELIMITER_BYTE_PCS[0]
+        itemMask = np.empty(itemSlots.shape, dtype=bool)
+        itemMask[:, :, 0:-1:2] = kept & cls._ENCODE_ESCAPED[itemBytes]
+        itemMask[:, :, 1:-1:2] = kept
+        itemMask[:, :, -1] = True
+
+        wire = np.empty((packetNum, itemNum * slotNum + 2), dtype=np.uint8)
+        wire[:, 0] = wire[:, -1] = cls._PACKET_DELIMITER_BYTE_PCS[0]
+        wire[:, 1:-1] = itemSlots.reshape(packetNum, itemNum * slotNum)
+        mask = np.ones(wire.shape, dtype=bool)
+        mask[:, 1:-1] = itemMask.reshape(packetNum, itemNum * slotNum)
+        return wire[mask].tobytes()
 
     @classmethod
-    def receive(cls, packet):
+    def encodeFrames(cls, packets):
+        """Converts every row of a 2D int8, int16, int32 or float32 array into consecutive binary
+        frames"""
+        items = np.asarray(packets)
+        if items.ndim != 2:
+            items = items.reshape(1, -1)
+        dtype = items.dtype.newbyteorder("<")
+        if dtype not in cls._BINARY_CODES:
+            raise TypeError(f"Binary frames do not support {items.dtype}")
+        header = bytes([cls._BINARY_CODES[dtype]])
+        payloads = np.ascontiguousarray(items, dtype=dtype).tobytes()
+        rowLen = items.shape[1] * dtype.itemsize
+
+        frames = bytearray()
+        for row in range(len(items)):
+            raw = header + payloads[row * rowLen:(row + 1) * rowLen]
+            raw += binascii.crc_hqx(raw, cls._CRC16_INIT).to_bytes(2, "big")
+            frames += cls._cobsEncode(raw)
+            frames.append(cls._FRAME_DELIMITER)
+        return bytes(frames)
+
+    @staticmethod
+    def _cobsEncode(raw):
+        """Consistent overhead byte stuffing, removes every zero byte from raw"""
+        encoded = bytearray()
+        for block in raw.split(b"\x00"):
+            while len(block) >= 0xFE:
+                encoded.append(0xFF)
+                encoded += block[:0xFE]
+                block = block[0xFE:]
+            encoded.append(len(block) + 1)
+            encoded += block
+        return encoded
+
+    @staticmethod
+    def _cobsDecode(encoded):
+        """Undoes _cobsEncode, raises ValueError on malformed input"""
+        raw = bytearray()
+        position = 0
+        while position < len(encoded):
+            code = encoded[position]
+            end = position + code
+            if code == 0 or end > len(encoded):
+                raise ValueError("Malformed COBS block")
+            raw += encoded[position + 1:end]
+            position = end
+            if code < 0xFF and position < len(encoded):
+                raw.append(0)
+        return raw
+
+    @_defaultInstance
+    def setFraming(self, framing):
+        """Switches both directions of this link to FRAMING_LEGACY or FRAMING_BINARY
+
+        The other end has to switch too, see negotiateFraming. Binary frames carry int8, int16,
+        int32 or float32 arrays with a CRC-16 per packet instead of 5 bits per byte, but the C++
+        library only speaks FRAMING_LEGACY, which stays the default."""
+        if framing not in self._FRAMING_CODES:
+            raise ValueError(f"Unknown framing {framing!r}")
+        if framing == self._framing:
+            return
+        decoderType = self._BinaryDecoder if framing == self.FRAMING_BINARY else self._Decoder
+        decoder = decoderType(self, len(self._decoder.getScratch()),
+                              self._decoder.getErrorPolicy())
+        decoder.setErrorCounts(self._decoder.getErrorCounts())
+        self._decoder = decoder
+        self._framing = framing
+
+    @_defaultInstance
+    def getFraming(self):
+        """Returns the framing in use"""
+        return self._framing
+
+    @_defaultInstance
+    def acceptNegotiation(self, accept=True):
+        """Chooses whether receiveAll and the reader answer negotiateFraming requests
+
+        Off by default, since the control packets are ordinary two item packets and a peer
+        sending the same items as data would otherwise switch the framing of this end."""
+        self._acceptNegotiation = accept
+
+    @_defaultInstance
+    def negotiateFraming(self, framing, timeout=1.0):
+        """Asks the other end to switch to framing and switches too once it agrees
+
+        Returns whether the other end agreed before timeout seconds passed. A SerialWrapper on
+        the other end agrees from receiveAll or its reader once it has called acceptNegotiation,
+        while other ends never answer so the link stays as it is. Packets that arrive meanwhile
+        are returned by the next receiveAll."""
+        code = self._FRAMING_CODES.get(framing)
+        if code is None:
+            raise ValueError(f"Unknown framing {framing!r}")
+        self.send(np.array([self._FRAMING_REQUEST, code], dtype=np.int32))
+
+        deadline = time.perf_counter() + timeout
+        while time.perf_counter() < deadline:
+            # One packet at a time since anything after the answer uses the new framing
+            data = self._takePending() + self._serial.read(self._serial.in_waiting)
+            packets, consumed = self._decoder.feed(data, limit=1)
+            error = self._keepRest(data, consumed)
+            if error is not None:
+                raise error
+            for packet in packets:
+                if self._isControl(packet, self._FRAMING_ACK) and packet[1] == code:
+                    self.setFraming(framing)
+                    return True
+                self._held.append(packet)
+            if not packets:
+                time.sleep(0.001)
+        return False
+
+    def _isControl(self, packet, kind):
+        """Checks whether packet is a negotiateFraming control packet of the given kind"""
+        return len(packet) == 2 and packet.dtype.kind == "i" and packet[0] == kind
+
+    def _answerControl(self, packets):
+        """Answers framing requests among packets and returns the other packets
+
+        Every packet is returned as it is unless acceptNegotiation was called."""
+        if not self._acceptNegotiation or not any(self._isControl(packet, self._FRAMING_REQUEST)
+                   or self._isControl(packet, self._FRAMING_ACK) for packet in packets
+                   if not isinstance(packet, self.SerialError)):
+            return packets
+        others = []
+        for packet in packets:
+            if isinstance(packet, self.SerialError):
+                others.append(packet)
+            elif self._isControl(packet, self._FRAMING_REQUEST):
+                for framing, code in self._FRAMING_CODES.items():
+                    if packet[1] == code:
+                        # The answer still uses the old framing but nothing may be decoded with
+                        # the old framing once it is out
+                        answer = self._encodeFor(self._framing,
+                                                 np.array([[self._FRAMING_ACK, code]], np.int32),
+                                                 self._decoder)
+                        self.setFraming(framing)
+                        self._serial.write(answer)
+            elif not self._isControl(packet, self._FRAMING_ACK):
+                others.append(packet)
+        return others
+
+    @_defaultInstance
+    def receive(self, packet):
         """Receive packet with protocol"""
-        while cls._serial.in_waiting:
-            message = cls._unprocess(cls._serial.read())
+        if self._framing != self.FRAMING_LEGACY:
+            raise RuntimeError("receive only supports FRAMING_LEGACY, use receiveAll instead")
+        while self._serial.in_waiting:
+            message = self._unprocess(self._serial.read())
             if message != -1:
-                status, packet = cls._receiveSM(packet, message)
+                status, packet = self._receiveSM(packet, message)
                 if status:
-                    if cls._itemNum:
-                        itemNum = cls._itemNum
-                        cls._itemNum = 0
+                    if self._itemNum:
+                        itemNum = self._itemNum
+                        self._itemNum = 0
                         return packet, itemNum
                     else:
                         packet = np.zeros(len(packet), np.int32)
             else:
-                cls._state = cls._State.INIT
-                cls._itemNum = 0
+                self._state = self._State.INIT
+                self._itemNum = 0
+                self._decoder.reportError(self.CorruptByteError)
 
         return packet, -1
 
+    @_defaultInstance
+    def receiveAll(self):
+        """Reads every waiting byte at once and returns a list of all complete packets
+
+        Partial packets are kept until the rest of them arrives. Do not mix with receive since both
+        consume the same bytes."""
+        held = self._held
+        self._held = []
+        data = self._takePending() + self._serial.read(self._serial.in_waiting)
+        packets, consumed = self._decoder.feed(data)
+        packets = self._answerControl(held + packets)
+        error = self._keepRest(data, consumed)
+        if error is not None:
+            error.packets = packets
+            raise error
+        return packets
+
+    @_defaultInstance
+    def receiveInto(self, buffer):
+        """Decodes the next packet straight into buffer and returns its item count or -1
+
+        Like receive, keep passing the same buffer until a count is returned since a packet that
+        is still arriving is kept in it. Bytes after the packet are kept for the next call."""
+        self._intoCount = -1
+        while self._intoCount == -1:
+            data = self._takePending()
+            if not data:
+                if not self._serial.in_waiting:
+                    break
+                data = self._serial.read(self._serial.in_waiting)
+            consumed = self._decoder.decode(data, buffer, self._commitInto)
+            error = self._keepRest(data, consumed)
+            if error is not None:
+                raise error
+        return self._intoCount
+
+    @_defaultInstance
+    def receiveRing(self, ring):
+        """Decodes every waiting byte straight into the slots of a PacketRing and returns how many
+        packets were added
+
+        Keep using the same ring on this link since a packet that is still arriving is kept in
+        its write slot."""
+        committed = ring._committed
+        data = self._takePending() + self._serial.read(self._serial.in_waiting)
+        consumed = self._decoder.decode(data, ring._writeRow(), ring._commit)
+        error = self._keepRest(data, consumed)
+        if error is not None:
+            raise error
+        return ring._committed - committed
+
+    def _commitInto(self, count):
+        """Stops decoding after the first packet for receiveInto"""
+        self._intoCount = count
+        return None
+
+    def _keepRest(self, data, consumed):
+        """Keeps the bytes that decoding stopped before and returns the error to raise, if any"""
+        if consumed < len(data):
+            self._pending = data[consumed:]
+        return self._decoder.takeError()
+
+    def _takePending(self):
+        """Returns and clears the bytes left over by receiveInto"""
+        pending = self._pending
+        self._pending = b""
+        return pending
+
+    @_defaultInstance
+    def startReader(self, maxsize=64, overflow=READER_OVERFLOW_DROP_OLDEST, poll_interval=0.1):
+        """Starts a background thread that decodes packets into a bounded queue
+
+        When the queue is full the oldest packet is dropped or the reader blocks until there is
+        room, depending on overflow. The port's read timeout is set to poll_interval while the
+        reader runs so that stopReader is noticed. Do not call receive or receiveAll meanwhile."""
+        if overflow not in (self.READER_OVERFLOW_DROP_OLDEST, self.READER_OVERFLOW_BLOCK):
+            raise ValueError(f"Unknown overflow policy {overflow!r}")
+        if self._reader is not None:
+            if not self._readerStop.is_set():
+                raise RuntimeError("Reader is already running. Use .stopReader() to stop it")
+            # The previous reader stopped itself after a port error
+            self.stopReader()
+
+        self._readerPackets = queue.Queue(maxsize=maxsize)
+        self._readerOverflow = overflow
+        self._readerLatest = None
+        self._readerDropped = 0
+        self._readerStop = threading.Event()
+        self._readerTimeout = self._serial.timeout
+        self._serial.timeout = poll_interval
+        self._reader = threading.Thread(target=self._readerLoop, name="SerialWrapperReader",
+                                       daemon=True)
+        self._reader.start()
+
+    @_defaultInstance
+    def stopReader(self):
+        """Stops the background reader and restores the port's read timeout"""
+        if self._reader is None:
+            return
+        self._readerStop.set()
+        self._reader.join()
+        self._reader = None
+        self._serial.timeout = self._readerTimeout
+
+    @_defaultInstance
+    def getPacket(self, block=True, timeout=None):
+        """Returns the oldest (timestamp, packet) pair from the reader or None if there is none
+
+        With ERROR_POLICY_RAISE the errors the reader ran into are raised here in order. A port
+        error stops the reader and is raised here after the packets read before it. Once the
+        reader has stopped this no longer blocks."""
+        if self._readerStop.is_set():
+            block = False
+        try:
+            timestamp, packet = self._readerPackets.get(block=block, timeout=timeout)
+        except queue.Empty:
+            return None
+        if isinstance(packet, Exception):
+            raise packet
+        return timestamp, packet
+
+    @_defaultInstance
+    def getLatestPacket(self):
+        """Returns the most recent (timestamp, packet) pair without consuming the queue"""
+        return self._readerLatest
+
+    @_defaultInstance
+    def getDroppedPackets(self):
+        """Returns how many packets the reader has dropped because the queue was full"""
+        return self._readerDropped
+
+    def _readerLoop(self):
+        """Blocks on the port and pushes timestamped packets until stopReader is called or the
+        port fails"""
+        while not self._readerStop.is_set():
+            try:
+                data = self._serial.read(max(1, self._serial.in_waiting))
+                if not data:
+                    continue
+                timestamp = time.perf_counter()
+                packets = self._answerControl(self._decoder.feedAll(data))
+            except (serial.SerialException, OSError) as e:
+                self._readerPut((time.perf_counter(), e))
+                self._readerStop.set()
+                return
+            for packet in packets:
+                if isinstance(packet, self.SerialError):
+                    self._readerPut((timestamp, packet))
+                else:
+                    self._readerLatest = (timestamp, packet)
+                    self._readerPut(self._readerLatest)
+
     @classmethod
-    def _write(cls, item):
-        if (item == cls._PACKET_DELIMITER_BYTE or item == cls._ITEM_DELIMITER_BYTE or item == cls._ESCAPE_BYTE):
-            cls._serial.write(cls._ESCAPE_BYTE_PCS)
-            cls._serial.write(cls._process(cls._escape(item)))
+    async def openStream(cls, serial_port, baud_rate, max_queued_packets=64,
+                         write_high_water=None, write_low_water=None, max_items=256,
+                         error_policy=ERROR_POLICY_DROP, framing=FRAMING_LEGACY):
+        """Opens serial port as an asyncio Stream driven by the running event loop
+
+        The stream is independent of the port opened with begin and only works on POSIX systems
+        since it watches the port's file descriptor. Its framing is fixed, as negotiateFraming is
+        not available on streams."""
+        if framing not in cls._FRAMING_CODES:
+            raise ValueError(f"Unknown framing {framing!r}")
+        loop = asyncio.get_running_loop()
+        serial_instance = serial.Serial(serial_port, baud_rate, timeout=0, write_timeout=0)
+        decoderType = cls._BinaryDecoder if framing == cls.FRAMING_BINARY else cls._Decoder
+        protocol = cls._StreamProtocol(decoderType(cls, max_items, error_policy),
+                                       max_queued_packets, framing)
+        cls._SerialTransport(loop, protocol, serial_instance, write_high_water, write_low_water)
+        await protocol.waitConnected()
+        return cls.Stream(protocol)
+
+    def _readerPut(self, entry):
+        """Queues entry according to the overflow policy"""
+        if self._readerOverflow == self.READER_OVERFLOW_BLOCK:
+            while not self._readerStop.is_set():
+                try:
+                    self._readerPackets.put(entry, timeout=self._serial.timeout)
+                    return
+                except queue.Full:
+                    pass
         else:
-            cls._serial.write(cls._process(item))
+            while True:
+                try:
+                    self._readerPackets.put_nowait(entry)
+                    return
+                except queue.Full:
+                    try:
+                        self._readerPackets.get_nowait()
+                        self._readerDropped += 1
+                    except queue.Empty:
+                        pass
 
-    @classmethod
-    def _receiveSM(cls, buffer, byte_in):
+    def _receiveSM(self, buffer, byte_in):
         """Facilitate protocol with state machine"""
-        if cls._state == cls._State.INIT:
-            if byte_in == cls._PACKET_DELIMITER_BYTE:
-                cls._state = cls._State.NORMAL
+        if self._state == self._State.INIT:
+            if byte_in == self._PACKET_DELIMITER_BYTE:
+                self._state = self._State.NORMAL
             return False, buffer
-        elif cls._state == cls._State.NORMAL:
-            if byte_in == cls._PACKET_DELIMITER_BYTE:
+        elif self._state == self._State.NORMAL:
+            if byte_in == self._PACKET_DELIMITER_BYTE:
                 return True, buffer
-            if byte_in == cls._ITEM_DELIMITER_BYTE:
-                cls._itemNum += 1
-                if cls._itemNum >= len(buffer):
-                    while True:
-                        print("[ERROR] PACKET LENGTH OVERFLOW! PLEASE ALLOCATE MORE MEMORY!")
+            if byte_in == self._ITEM_DELIMITER_BYTE:
+                self._itemNum += 1
+                if self._itemNum >= len(buffer):
+                    self._state = self._State.INIT
+                    self._itemNum = 0
+                    self._decoder.reportError(self.PacketOverflowError)
                 return False, buffer
-            if byte_in == cls._ESCAPE_BYTE:
-                cls._state = cls._State.ESCAPE
+            if byte_in == self._ESCAPE_BYTE:
+                self._state = self._State.ESCAPE
                 return False, buffer
-            buffer[cls._itemNum] = buffer[cls._itemNum] << cls._ITEM_BIT_LEN
-            buffer[cls._itemNum] += byte_in
+            buffer[self._itemNum] = buffer[self._itemNum] << self._ITEM_BIT_LEN
+            buffer[self._itemNum] += byte_in
             return False, buffer
-        elif cls._state == cls._State.ESCAPE:
-            buffer[cls._itemNum] = buffer[cls._itemNum] << cls._ITEM_BIT_LEN
-            buffer[cls._itemNum] += cls._unescape(byte_in)
-            cls._state = cls._State.NORMAL
+        elif self._state == self._State.ESCAPE:
+            buffer[self._itemNum] = buffer[self._itemNum] << self._ITEM_BIT_LEN
+            buffer[self._itemNum] += self._unescape(byte_in)
+            self._state = self._State.NORMAL
             return False, buffer
 
     @classmethod
@@ -146,7 +667,6 @@ class SerialWrapper:
         if cls._CRC_CALCULATOR[message] == crc:
             return message
         else:
-            print("[WARNING] CORRUPT BYTE DETECTED")
             return -1
 
     @classmethod
@@ -169,13 +689,684 @@ class SerialWrapper:
         """Convert to number and undo CRC"""
         return cls._undoCRC(ord(byte))
 
-    @classmethod
-    def getSerial(cls):
+    @_defaultInstance
+    def setErrorPolicy(self, policy):
+        """Chooses what happens on out of range items, packet overflows and corrupt bytes
+
+        ERROR_POLICY_RAISE raises the matching SerialError, keeping the bytes after the error for
+        the next call. ERROR_POLICY_DROP discards the packet, skipping to the next packet
+        delimiter, and carries on decoding after it. ERROR_POLICY_RESYNC is another name for it.
+        Every error is counted whatever the policy."""
+        self._decoder.setErrorPolicy(policy)
+
+    @_defaultInstance
+    def getErrorPolicy(self):
+        """Returns the error policy"""
+        return self._decoder.getErrorPolicy()
+
+    @_defaultInstance
+    def getErrorCounts(self):
+        """Returns how many errors of each SerialError kind have been seen"""
+        return self._decoder.getErrorCounts()
+
+    @_defaultInstance
+    def resetErrorCounts(self):
+        """Sets every error count back to 0"""
+        self._decoder.resetErrorCounts()
+
+    @_defaultInstance
+    def getSerial(self):
         """Procide serial object"""
-        return cls._serial
+        return self._serial
 
     class _State(enum.Enum):
         """Enum for states of Serial protocol"""
         INIT = 0
         NORMAL = 1
         ESCAPE = 2
+
+    class _Decoder:
+        """Runs the protocol state machine over whole buffers of received bytes"""
+        __slots__ = ("_table", "_corrupt", "_packetDelimiter", "_itemDelimiter", "_escapeByte",
+                     "_conversion", "_itemBitLen", "_state", "_count", "_item", "_scratch",
+                     "_packets", "_limit", "_errorPolicy", "_errorTypes", "_errorCounts",
+                     "_error")
+
+        def __init__(self, wrapper, max_items, error_policy):
+            self._table = wrapper._DECODE_TABLE
+            self._corrupt = wrapper._CORRUPT_BYTE
+            self._packetDelimiter = wrapper._PACKET_DELIMITER_BYTE
+            self._itemDelimiter = wrapper._ITEM_DELIMITER_BYTE
+            self._escapeByte = wrapper._ESCAPE_BYTE
+            self._conversion = wrapper._CONVERSION
+            self._itemBitLen = wrapper._ITEM_BIT_LEN
+            self._state = wrapper._State.INIT.value
+            self._count = 0
+            self._item = 0
+            self._scratch = np.zeros(max_items, dtype=np.int32)
+            self._packets = None
+            self._limit = None
+            self._errorTypes = (wrapper.ItemRangeError, wrapper.PacketOverflowError,
+                                wrapper.CorruptByteError, wrapper.CorruptFrameError)
+            self._errorCounts = {errorType.kind: 0 for errorType in self._errorTypes}
+            self._error = None
+            self.setErrorPolicy(error_policy)
+
+        def setErrorPolicy(self, policy):
+            """Sets one of the SerialWrapper.ERROR_POLICY_* values"""
+            if policy not in (SerialWrapper.ERROR_POLICY_RAISE, SerialWrapper.ERROR_POLICY_DROP):
+                raise ValueError(f"Unknown error policy {policy!r}")
+            self._errorPolicy = policy
+
+        def getErrorPolicy(self):
+            """Returns the error policy"""
+            return self._errorPolicy
+
+        def getErrorCounts(self):
+            """Returns a copy of the error counts"""
+            return dict(self._errorCounts)
+
+        def resetErrorCounts(self):
+            """Sets every error count back to 0"""
+            for kind in self._errorCounts:
+                self._errorCounts[kind] = 0
+
+        def setErrorCounts(self, counts):
+            """Carries over the counts of another decoder"""
+            self._errorCounts.update(counts)
+
+        def getScratch(self):
+            """Returns the row packets are decoded into before being copied out"""
+            return self._scratch
+
+        def reportError(self, errorType, count=1):
+            """Counts an error found outside of decode and raises it if the policy says so"""
+            self._errorCounts[errorType.kind] += count
+            if self._errorPolicy == SerialWrapper.ERROR_POLICY_RAISE:
+                raise errorType(errorType.message)
+
+        def takeError(self):
+            """Returns the error decode stopped at, if any, and clears it"""
+            errorType = self._error
+            self._error = None
+            if errorType is None:
+                return None
+            return errorType(errorType.message)
+
+        def feed(self, data, limit=None):
+            """Decodes data and returns the complete packets in it as np.int32 arrays along with
+            how many bytes were consumed, stopping after limit packets if given"""
+            self._packets = []
+            self._limit = limit
+            consumed = self.decode(data, self._scratch, self._copyScratch)
+            packets = self._packets
+            self._packets = None
+            return packets, consumed
+
+        def feedAll(self, data):
+            """Decodes all of data and returns its packets with any errors raised by the policy
+            in between them in order"""
+            entries = []
+            while data:
+                packets, consumed = self.feed(data)
+                entries += packets
+                error = self.takeError()
+                if error is None:
+                    break
+                entries.append(error)
+                data = data[consumed:]
+            return entries
+
+        def _copyScratch(self, count):
+            self._packets.append(self._scratch[:count].copy())
+            if len(self._packets) == self._limit:
+                return None
+            return self._scratch
+
+        def decode(self, data, row, commit):
+            """Decodes data writing the items of the current packet into row in place
+
+            Every complete packet calls commit(count), which returns the row the next packet is
+            written into or None to stop decoding. Returns how many bytes of data were consumed.
+            Corrupt bytes and packets longer than their row are counted and, with
+            ERROR_POLICY_RAISE, stop decoding so that takeError returns them. Otherwise the
+            decoder skips to the next packet delimiter and carries on."""
+            INIT = SerialWrapper._State.INIT.value
+            NORMAL = SerialWrapper._State.NORMAL.value
+            ESCAPE = SerialWrapper._State.ESCAPE.value
+            corrupt = self._corrupt
+            packetDelimiter = self._packetDelimiter
+            itemDelimiter = self._itemDelimiter
+            escapeByte = self._escapeByte
+            conversion = self._conversion
+            itemBitLen = self._itemBitLen
+            stopOnError = self._errorPolicy == SerialWrapper.ERROR_POLICY_RAISE
+
+            state = self._state
+            count = self._count
+            item = self._item
+            capacity = len(row)
+            consumed = len(data)
+            for position, message in enumerate(data.translate(self._table)):
+                if message == corrupt:
+                    state = INIT
+                    count = 0
+                    item = 0
+                    self._errorCounts[SerialWrapper.CorruptByteError.kind] += 1
+                    if stopOnError:
+                        self._error = SerialWrapper.CorruptByteError
+                        consumed = position + 1
+                        break
+                elif state == NORMAL:
+                    if message == packetDelimiter:
+                        item = 0
+                        if count:
+                            row = commit(count)
+                            count = 0
+                            if row is None:
+                                consumed = position + 1
+                                break
+                            capacity = len(row)
+                    elif message == itemDelimiter:
+                        if count < capacity:
+                            row[count] = ((item & 0xFFFFFFFF) ^ 0x80000000) - 0x80000000
+                            count += 1
+                        else:
+                            state = INIT
+                            count = 0
+                            self._errorCounts[SerialWrapper.PacketOverflowError.kind] += 1
+                            if stopOnError:
+                                self._error = SerialWrapper.PacketOverflowError
+                                consumed = position + 1
+                                break
+                        item = 0
+                    elif message == escapeByte:
+                        state = ESCAPE
+                    else:
+                        item = (item << itemBitLen) + message
+                elif state == ESCAPE:
+                    item = (item << itemBitLen) + (message ^ conversion)
+                    state = NORMAL
+                elif message == packetDelimiter:
+                    state = NORMAL
+
+            self._state = state
+            self._count = count
+            self._item = item
+            return consumed
+
+    class _BinaryDecoder(_Decoder):
+        """Splits received bytes into COBS frames and unpacks them into typed arrays"""
+        __slots__ = ("_frame", "_maxFrameLen", "_skipping")
+
+        def __init__(self, wrapper, max_items, error_policy):
+            super().__init__(wrapper, max_items, error_policy)
+            self._frame = bytearray()
+            self._skipping = False
+            rawLen = 1 + 4 * max_items + 2
+            self._maxFrameLen = rawLen + rawLen // 0xFE + 1
+
+        def feed(self, data, limit=None):
+            """Decodes data and returns the complete packets in it as arrays of the dtype they
+            were sent with along with how many bytes were consumed"""
+            packets = []
+            def store(packet):
+                packets.append(packet)
+                return len(packets) != limit
+            consumed = self._frames(data, store)
+            return packets, consumed
+
+        def decode(self, data, row, commit):
+            """Decodes data writing the items of every packet into row, see _Decoder.decode"""
+            def store(packet):
+                nonlocal row
+                if len(packet) > len(row):
+                    return self._stopOnError(SerialWrapper.PacketOverflowError)
+                row[:len(packet)] = packet
+                row = commit(len(packet))
+                return row is not None
+            return self._frames(data, store)
+
+        def _frames(self, data, handle):
+            """Calls handle(packet) for every frame completed by data until it returns False and
+            returns how many bytes were consumed"""
+            position = 0
+            while position < len(data):
+                end = data.find(SerialWrapper._FRAME_DELIMITER, position)
+                if end == -1:
+                    if not self._skipping:
+                        self._frame += data[position:]
+                        if len(self._frame) > self._maxFrameLen:
+                            # Drop what is buffered and the rest of the frame once it ends
+                            self._frame.clear()
+                            self._skipping = True
+                            self._stopOnError(SerialWrapper.PacketOverflowError)
+                    return len(data)
+                frame = self._frame + data[position:end]
+                self._frame.clear()
+                position = end + 1
+                if self._skipping or not frame:
+                    self._skipping = False
+                    continue
+                if len(frame) > self._maxFrameLen:
+                    if not self._stopOnError(SerialWrapper.PacketOverflowError):
+                        return position
+                    continue
+                packet = self._unpack(frame)
+                if packet is None:
+                    if not self._stopOnError(SerialWrapper.CorruptFrameError):
+                        return position
+                elif not handle(packet):
+                    return position
+            return len(data)
+
+        def _unpack(self, frame):
+            """Returns the array in frame or None if it is corrupt"""
+            try:
+                raw = SerialWrapper._cobsDecode(frame)
+            except ValueError:
+                return None
+            if (len(raw) < 3 or binascii.crc_hqx(raw[:-2], SerialWrapper._CRC16_INIT)
+                    != int.from_bytes(raw[-2:], "big")):
+                return None
+            dtype = SerialWrapper._BINARY_DTYPES.get(raw[0])
+            if dtype is None or (len(raw) - 3) % dtype.itemsize:
+                return None
+            return np.frombuffer(raw, dtype, (len(raw) - 3) // dtype.itemsize, 1)
+
+        def _stopOnError(self, errorType):
+            """Counts an error and returns whether decoding may carry on"""
+            self._errorCounts[errorType.kind] += 1
+            if self._errorPolicy != SerialWrapper.ERROR_POLICY_RAISE:
+                return True
+            self._error = errorType
+            return False
+
+    class PacketRing:
+        """Fixed number of packet slots backed by one contiguous np.int32 array
+
+        Packets are decoded straight into the slots by SerialWrapper.receiveRing and handed out as
+        slot indices, so steady state decoding allocates no arrays. One slot is always kept free
+        for the packet being decoded, and when every other slot is full the oldest packet is
+        dropped."""
+        __slots__ = ("_slots", "_rows", "_lengths", "_head", "_tail", "_size", "_dropped",
+                     "_committed")
+
+        def __init__(self, slot_num, max_items):
+            if slot_num < 2:
+                raise ValueError("PacketRing needs at least 2 slots")
+            self._slots = np.zeros((slot_num, max_items), dtype=np.int32)
+            self._rows = list(self._slots)
+            self._lengths = np.zeros(slot_num, dtype=np.intp)
+            self._head = 0
+            self._tail = 0
+            self._size = 0
+            self._dropped = 0
+            self._committed = 0
+
+        def acquire(self):
+            """Returns the slot index of the oldest packet or -1 if the ring is empty"""
+            return self._head if self._size else -1
+
+        def release(self):
+            """Frees the slot of the oldest packet"""
+            if self._size:
+                self._head = (self._head + 1) % len(self._rows)
+                self._size -= 1
+
+        def getRow(self, slot):
+            """Returns the full width row of slot, only its first getLength(slot) items are
+            valid"""
+            return self._rows[slot]
+
+        def getLength(self, slot):
+            """Returns the item count of the packet in slot"""
+            return self._lengths[slot]
+
+        def getPacket(self, slot):
+            """Returns a view of the items of the packet in slot"""
+            return self._rows[slot][:self._lengths[slot]]
+
+        def getSlots(self):
+            """Returns the 2D array backing every slot"""
+            return self._slots
+
+        def getLengths(self):
+            """Returns the item count of every slot"""
+            return self._lengths
+
+        def getSize(self):
+            """Returns how many packets are waiting"""
+            return self._size
+
+        def getDropped(self):
+            """Returns how many packets were dropped because the ring was full"""
+            return self._dropped
+
+        def _writeRow(self):
+            """Returns the row the next packet is decoded into"""
+            return self._rows[self._tail]
+
+        def _commit(self, count):
+            """Stores the packet in the write slot and returns the next write row"""
+            slotNum = len(self._rows)
+            self._lengths[self._tail] = count
+            self._tail = (self._tail + 1) % slotNum
+            self._committed += 1
+            if self._size == slotNum - 1:
+                self._head = (self._head + 1) % slotNum
+                self._dropped += 1
+            else:
+                self._size += 1
+            return self._rows[self._tail]
+
+    class Multiplexer:
+        """Services several SerialWrapper links from one thread with a selector"""
+        def __init__(self):
+            self._selector = selectors.DefaultSelector()
+
+        def register(self, link, callback=None):
+            """Watches link and calls callback(link, packet) for every packet it receives"""
+            self._selector.register(link.getSerial().fileno(), selectors.EVENT_READ,
+                                    (link, callback))
+
+        def unregister(self, link):
+            """Stops watching link"""
+            self._selector.unregister(link.getSerial().fileno())
+
+        def poll(self, timeout=None):
+            """Waits up to timeout seconds for data and returns a list of (link, packets) pairs for
+            every link that had complete packets"""
+            received = []
+            for key, _ in self._selector.select(timeout):
+                link, callback = key.data
+                packets = link.receiveAll()
+                if packets:
+                    if callback is not None:
+                        for packet in packets:
+                            callback(link, packet)
+                    received.append((link, packets))
+            return received
+
+        def close(self):
+            """Closes the selector but not the links"""
+            self._selector.close()
+
+    class Stream:
+        """Sends and receives packets over an event loop driven serial transport"""
+        def __init__(self, protocol):
+            self._protocol = protocol
+
+        async def send(self, packet):
+            """Writes packet and waits while the transport's write buffer is too full"""
+            await self.sendBatch(np.asarray(packet)[np.newaxis])
+
+        async def sendBatch(self, packets):
+            """Writes every row of a 2D array of packets and waits on the write buffer"""
+            wire = SerialWrapper._encodeFor(self._protocol.getFraming(), packets,
+                                            self._protocol.getDecoder())
+            if wire:
+                self._protocol.write(wire)
+            await self._protocol.drain()
+
+        async def receive(self):
+            """Returns the next packet or None once the port is closed
+
+            With ERROR_POLICY_RAISE the errors found while decoding are raised here in order."""
+            return await self._protocol.getPacket()
+
+        def __aiter__(self):
+            return self
+
+        async def __anext__(self):
+            packet = await self._protocol.getPacket()
+            if packet is None:
+                raise StopAsyncIteration
+            return packet
+
+        def close(self):
+            """Flushes pending writes and closes the port"""
+            self._protocol.close()
+
+        async def waitClosed(self):
+            """Waits until the port is closed"""
+            await self._protocol.waitClosed()
+
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, exc_type, exc_value, exc_traceback):
+            self.close()
+            await self.waitClosed()
+
+        def getTransport(self):
+            """Returns the underlying serial transport"""
+            return self._protocol.getTransport()
+
+        def getErrorCounts(self):
+            """Returns how many errors of each SerialError kind have been seen"""
+            return self._protocol.getDecoder().getErrorCounts()
+
+    class _StreamProtocol(asyncio.Protocol):
+        """Decodes incoming bytes into a packet queue and tracks write flow control"""
+        def __init__(self, decoder, max_queued_packets, framing):
+            self._decoder = decoder
+            self._framing = framing
+            self._max_queued_packets = max_queued_packets
+            self._packets = asyncio.Queue()
+            self._transport = None
+            self._connected = asyncio.get_running_loop().create_future()
+            self._closed = asyncio.get_running_loop().create_future()
+            self._reading_paused = False
+            self._drain_waiter = None
+
+        def connection_made(self, transport):
+            self._transport = transport
+            self._connected.set_result(None)
+
+        def data_received(self, data):
+            for packet in self._decoder.feedAll(data):
+                self._packets.put_nowait(packet)
+            if not self._reading_paused and self._packets.qsize() >= self._max_queued_packets:
+                self._reading_paused = True
+                self._transport.pause_reading()
+
+        def connection_lost(self, exc):
+            self._packets.put_nowait(None)
+            if not self._closed.done():
+                self._closed.set_result(None)
+            self.resume_writing()
+
+        def pause_writing(self):
+            if self._drain_waiter is None:
+                self._drain_waiter = asyncio.get_running_loop().create_future()
+
+        def resume_writing(self):
+            if self._drain_waiter is not None:
+                if not self._drain_waiter.done():
+                    self._drain_waiter.set_result(None)
+                self._drain_waiter = None
+
+        async def waitConnected(self):
+            """Waits for connection_made"""
+            await self._connected
+
+        async def waitClosed(self):
+            """Waits for connection_lost"""
+            await self._closed
+
+        def write(self, data):
+            """Writes data or raises if the port is closed"""
+            if self._transport.is_closing():
+                raise ConnectionResetError("Serial port is closed")
+            self._transport.write(data)
+
+        async def drain(self):
+            """Waits until the transport's write buffer drops below its low water mark"""
+            if self._drain_waiter is not None:
+                await self._drain_waiter
+
+        async def getPacket(self):
+            """Returns the next decoded packet or None after the connection was lost"""
+            packet = await self._packets.get()
+            if isinstance(packet, SerialWrapper.SerialError):
+                raise packet
+            if packet is None:
+                self._packets.put_nowait(None)
+            elif self._reading_paused and self._packets.qsize() < self._max_queued_packets:
+                self._reading_paused = False
+                self._transport.resume_reading()
+            return packet
+
+        def close(self):
+            """Closes the transport"""
+            self._transport.close()
+
+        def getTransport(self):
+            """Returns the transport"""
+            return self._transport
+
+        def getDecoder(self):
+            """Returns the decoder"""
+            return self._decoder
+
+        def getFraming(self):
+            """Returns the framing"""
+            return self._framing
+
+    class _SerialTransport(asyncio.Transport):
+        """Non-blocking transport over the file descriptor of a serial.Serial"""
+        def __init__(self, loop, protocol, serial_instance, high_water=None, low_water=None):
+            super().__init__()
+            self._loop = loop
+            self._protocol = protocol
+            self._serial = serial_instance
+            self._fd = serial_instance.fileno()
+            os.set_blocking(self._fd, False)
+            self._write_buffer = bytearray()
+            self._closing = False
+            self._reading = True
+            self._protocol_paused = False
+            self.set_write_buffer_limits(high_water, low_water)
+            self._loop.add_reader(self._fd, self._read_ready)
+            self._loop.call_soon(self._protocol.connection_made, self)
+
+        def _read_ready(self):
+            try:
+                data = os.read(self._fd, 4096)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as exc:
+                self._force_close(exc)
+                return
+            if data:
+                self._protocol.data_received(data)
+            else:
+                self._force_close(None)
+
+        def write(self, data):
+            if self._closing:
+                return
+            if not self._write_buffer:
+                try:
+                    written = os.write(self._fd, data)
+                except (BlockingIOError, InterruptedError):
+                    written = 0
+                except OSError as exc:
+                    self._force_close(exc)
+                    return
+                data = memoryview(data)[written:]
+                if not data:
+                    return
+                self._loop.add_writer(self._fd, self._write_ready)
+            self._write_buffer += data
+            self._maybe_pause_protocol()
+
+        def _write_ready(self):
+            try:
+                written = os.write(self._fd, self._write_buffer)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as exc:
+                self._force_close(exc)
+                return
+            del self._write_buffer[:written]
+            self._maybe_resume_protocol()
+            if not self._write_buffer:
+                self._loop.remove_writer(self._fd)
+                if self._closing:
+                    self._call_connection_lost(None)
+
+        def _maybe_pause_protocol(self):
+            if not self._protocol_paused and len(self._write_buffer) > self._high_water:
+                self._protocol_paused = True
+                self._protocol.pause_writing()
+
+        def _maybe_resume_protocol(self):
+            if self._protocol_paused and len(self._write_buffer) <= self._low_water:
+                self._protocol_paused = False
+                self._protocol.resume_writing()
+
+        def set_write_buffer_limits(self, high=None, low=None):
+            if high is None:
+                high = 64 * 1024 if low is None else 4 * low
+            if low is None:
+                low = high // 4
+            if not high >= low >= 0:
+                raise ValueError(f"high ({high!r}) must be >= low ({low!r}) must be >= 0")
+            self._high_water = high
+            self._low_water = low
+
+        def get_write_buffer_limits(self):
+            return (self._low_water, self._high_water)
+
+        def get_write_buffer_size(self):
+            return len(self._write_buffer)
+
+        def pause_reading(self):
+            if self._reading and not self._closing:
+                self._reading = False
+                self._loop.remove_reader(self._fd)
+
+        def resume_reading(self):
+            if not self._reading and not self._closing:
+                self._reading = True
+                self._loop.add_reader(self._fd, self._read_ready)
+
+        def is_reading(self):
+            return self._reading and not self._closing
+
+        def is_closing(self):
+            return self._closing
+
+        def get_extra_info(self, name, default=None):
+            if name == "serial":
+                return self._serial
+            return default
+
+        def close(self):
+            if self._closing:
+                return
+            self._closing = True
+            self._loop.remove_reader(self._fd)
+            if not self._write_buffer:
+                self._loop.call_soon(self._call_connection_lost, None)
+
+        def abort(self):
+            self._force_close(None)
+
+        def _force_close(self, exc):
+            if self._closing and not self._write_buffer:
+                return
+            self._closing = True
+            self._write_buffer.clear()
+            self._loop.remove_reader(self._fd)
+            self._loop.remove_writer(self._fd)
+            self._loop.call_soon(self._call_connection_lost, exc)
+
+        def _call_connection_lost(self, exc):
+            if self._serial.is_open:
+                self._serial.close()
+                self._protocol.connection_lost(exc)
+
+SerialWrapper._initProtocol()